@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the NEC TV Control Service
+
+Drives the HTTP API of a running nec_tv_service.py, or of one it starts
+against the local NEC emulator, and measures latency percentiles and
+throughput per endpoint at several concurrency levels. Results are saved
+as JSON; pass a previous file with --compare to see the change.
+
+Usage:
+  python3 benchmark_nec_tv.py --start-service --delay 0.03 --output results.json
+  python3 benchmark_nec_tv.py --url http://homeassistant.local:8124 --endpoints get_power
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from urllib.parse import urlparse
+
+from nec_emulator import NECEmulator
+
+# name -> (method, path, body factory)
+ENDPOINTS = {
+    'health': ('GET', '/health', None),
+    'get_power': ('GET', '/power', None),
+    'get_power_fresh': ('GET', '/power?fresh=1', None),
+    'get_brightness': ('GET', '/brightness', None),
+    'get_brightness_fresh': ('GET', '/brightness?fresh=1', None),
+    'set_power': ('POST', '/power', lambda: {'action': random.choice(['on', 'off'])}),
+    'set_brightness': ('POST', '/brightness', lambda: {'brightness': random.randint(0, 100)}),
+}
+DEFAULT_ENDPOINTS = ['health', 'get_power', 'get_power_fresh', 'get_brightness_fresh', 'set_brightness']
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def worker(host, port, endpoint, deadline, latencies, errors):
+    """Send requests for one endpoint over a persistent connection until the deadline"""
+    method, path, body_factory = ENDPOINTS[endpoint]
+    conn = HTTPConnection(host, port, timeout=30)
+    while time.perf_counter() < deadline:
+        body = json.dumps(body_factory()) if body_factory else None
+        headers = {'Content-Type': 'application/json'} if body else {}
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - started
+            if response.status >= 400:
+                errors.append(response.status)
+            else:
+                latencies.append(elapsed)
+        except Exception as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = HTTPConnection(host, port, timeout=30)
+    conn.close()
+
+
+def run_level(host, port, endpoint, concurrency, duration):
+    """Run one endpoint at one concurrency level and summarize it"""
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker, args=(host, port, endpoint, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_types': sorted(set(map(str, errors))),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 0.50)),
+            'p95': ms(percentile(latencies, 0.95)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def start_service(tv_port, poll_interval):
+    """Start nec_tv_service.py against the emulator and wait for /health"""
+    env = os.environ.copy()
+    env.update({
+        'TV_IP': '127.0.0.1',
+        'TV_PORT': str(tv_port),
+        'POLL_INTERVAL': str(poll_interval),
+        # Every run starts cold
+        'SNAPSHOT_PATH': '',
+    })
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rootfs', 'usr', 'bin', 'nec_tv_service.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(50):
+        time.sleep(0.1)
+        try:
+            conn = HTTPConnection('127.0.0.1', 8124, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            pass
+        if process.poll() is not None:
+            break
+    process.kill()
+    raise RuntimeError("Service did not start")
+
+
+def print_results(results, baseline=None):
+    previous = {}
+    for entry in (baseline or {}).get('results', []):
+        previous[(entry['endpoint'], entry['concurrency'])] = entry
+    print(f"{'endpoint':<22}{'conc':>5}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for entry in results:
+        latency = entry['latency_ms']
+        line = (f"{entry['endpoint']:<22}{entry['concurrency']:>5}{entry['throughput_rps']:>10}"
+                f"{latency['p50']!s:>10}{latency['p95']!s:>10}{latency['p99']!s:>10}{entry['errors']:>8}")
+        old = previous.get((entry['endpoint'], entry['concurrency']))
+        if old and old['latency_ms']['p50'] and latency['p50'] and old['throughput_rps']:
+            p50_change = (latency['p50'] / old['latency_ms']['p50'] - 1) * 100
+            rps_change = (entry['throughput_rps'] / old['throughput_rps'] - 1) * 100
+            line += f"   p50 {p50_change:+.1f}%  req/s {rps_change:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NEC TV Control Service HTTP API')
+    parser.add_argument('--url', default='http://127.0.0.1:8124', help='service to benchmark')
+    parser.add_argument('--start-service', action='store_true',
+                        help='start the service on port 8124 against a local emulator')
+    parser.add_argument('--endpoints', default=','.join(DEFAULT_ENDPOINTS),
+                        help=f'comma separated, from: {", ".join(ENDPOINTS)}')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per endpoint and level')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    emulator_options = parser.add_argument_group('emulator (with --start-service)')
+    emulator_options.add_argument('--delay', type=float, default=0.02)
+    emulator_options.add_argument('--jitter', type=float, default=0.0)
+    emulator_options.add_argument('--split', type=int, default=0)
+    emulator_options.add_argument('--refuse-rate', type=float, default=0.0)
+    emulator_options.add_argument('--poll-interval', type=float, default=15)
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    emulator = process = None
+    if args.start_service:
+        emulator = NECEmulator(port=0, delay=args.delay, jitter=args.jitter,
+                               split=args.split, refuse_rate=args.refuse_rate)
+        tv_port = emulator.start()
+        print(f"Emulator on 127.0.0.1:{tv_port}, starting service")
+        process = start_service(tv_port, args.poll_interval)
+        url = urlparse('http://127.0.0.1:8124')
+    else:
+        url = urlparse(args.url)
+
+    results = []
+    try:
+        for endpoint in endpoints:
+            for level in levels:
+                print(f"Running {endpoint} at concurrency {level} for {args.duration}s")
+                results.append(run_level(url.hostname, url.port or 80, endpoint, level, args.duration))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=5)
+        if emulator is not None:
+            emulator.stop()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'url': url.geturl(),
+        'duration': args.duration,
+        'emulator': {
+            'delay': args.delay,
+            'jitter': args.jitter,
+            'split': args.split,
+            'refuse_rate': args.refuse_rate,
+            'stats': emulator.stats,
+        } if emulator else None,
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print()
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
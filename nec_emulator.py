@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+NEC display emulator for testing and benchmarking without a real panel
+
+Listens on a TCP port and answers the NEC external control protocol the
+way a display does: power status read and power control, and get/set
+parameter for brightness, contrast, input and volume. Unknown parameters
+get an "unsupported" reply. Reply delay, jitter, packets split over
+several writes and refused connections can be configured to mimic slow
+or flaky hardware, and like many real panels it can reject parameter
+reads and writes while in standby.
+
+Usage: python3 nec_emulator.py [--port 7142] [--delay 0.05] [--jitter 0.02]
+                               [--split 4] [--refuse-rate 0.1] [--standby-rejects]
+"""
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rootfs', 'usr', 'bin'))
+
+import nec_protocol
+from nec_protocol import SOH, STX, ETX, CR, CONTROLLER
+
+
+class NECEmulator:
+    """Emulated NEC display serving any number of controller connections
+
+    Replies are delayed by delay seconds plus up to jitter seconds. With
+    split set, each reply is written in chunks of that many bytes. A
+    refuse_rate share of new connections is reset right after accept, like
+    a panel that is busy or still booting. With standby_rejects, parameter
+    frames get an error reply unless the power is on.
+    """
+
+    def __init__(self, host='127.0.0.1', port=7142, monitor_id=1, delay=0.0, jitter=0.0,
+                 split=0, refuse_rate=0.0, standby_rejects=False):
+        self.host = host
+        self.port = port
+        self.monitor = nec_protocol.monitor_address(monitor_id)
+        self.delay = delay
+        self.jitter = jitter
+        self.split = split
+        self.refuse_rate = refuse_rate
+        self.standby_rejects = standby_rejects
+        self.power = 0x0001
+        # (page, code) -> [max, current]
+        self.parameters = {
+            nec_protocol.PARAMETERS['brightness']: [100, 70],
+            nec_protocol.PARAMETERS['contrast']: [100, 50],
+            nec_protocol.PARAMETERS['input']: [0x11, 0x11],
+            nec_protocol.PARAMETERS['volume']: [100, 20],
+        }
+        self.stats = {'connections': 0, 'refused': 0, 'frames': 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """Start listening in a background thread and return the bound port"""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(16)
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, name='nec-emulator', daemon=True).start()
+        return self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def _accept(self):
+        while self._server is not None:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.stats['connections'] += 1
+                refuse = random.random() < self.refuse_rate
+                if refuse:
+                    self.stats['refused'] += 1
+            if refuse:
+                # Linger 0 turns close() into a reset
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                conn.close()
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        buffer = bytearray()
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(1024)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buffer += data
+                while CR in buffer:
+                    end = buffer.index(CR) + 1
+                    frame = bytes(buffer[:end])
+                    del buffer[:end]
+                    reply = self.handle(frame)
+                    if reply is None:
+                        continue
+                    time.sleep(self.delay + random.uniform(0, self.jitter))
+                    try:
+                        self._send(conn, reply)
+                    except OSError:
+                        return
+
+    def _send(self, conn, reply):
+        if not self.split:
+            conn.sendall(reply)
+            return
+        for start in range(0, len(reply), self.split):
+            conn.sendall(reply[start:start + self.split])
+            time.sleep(0.001)
+
+    def reply(self, message_type, message):
+        """Monitor-to-controller frame around an ASCII message"""
+        body = (
+            '0' + CONTROLLER + self.monitor + message_type + f'{len(message) + 2:02X}'
+        ).encode('latin-1')
+        body += bytes([STX]) + message.encode('ascii') + bytes([ETX])
+        return bytes([SOH]) + body + bytes([nec_protocol.bcc(body), CR])
+
+    def handle(self, frame):
+        """Reply frame for one controller frame, or None to stay silent"""
+        if len(frame) < 11 or frame[0] != SOH or ETX not in frame:
+            return None
+        if nec_protocol.bcc(frame[1:-2]) != frame[-2]:
+            return None
+        header = frame[1:7].decode('latin-1')
+        if header[1] not in (self.monitor, nec_protocol.ALL_MONITORS):
+            return None
+        message_type = header[3]
+        message = frame[8:frame.index(ETX)].decode('ascii', 'replace')
+        with self._lock:
+            self.stats['frames'] += 1
+            if message_type == nec_protocol.TYPE_COMMAND:
+                return self._command(message)
+            if message_type in (nec_protocol.TYPE_GET_PARAMETER, nec_protocol.TYPE_SET_PARAMETER):
+                return self._parameter(message_type, message)
+        return None
+
+    def _command(self, message):
+        if message == '01D6':
+            return self.reply(nec_protocol.TYPE_COMMAND_REPLY, f'0200D6000004{self.power:04X}')
+        if message.startswith('C203D6') and len(message) == 10:
+            self.power = int(message[6:10], 16)
+            return self.reply(nec_protocol.TYPE_COMMAND_REPLY, f'00C203D6{self.power:04X}')
+        return None
+
+    def _parameter(self, message_type, message):
+        page, code = int(message[0:2], 16), int(message[2:4], 16)
+        reply_type = (nec_protocol.TYPE_GET_PARAMETER_REPLY if message_type == nec_protocol.TYPE_GET_PARAMETER
+                      else nec_protocol.TYPE_SET_PARAMETER_REPLY)
+        parameter = self.parameters.get((page, code))
+        if parameter is None or (self.standby_rejects and self.power != 0x0001):
+            return self.reply(reply_type, f'01{page:02X}{code:02X}0000000000')
+        if message_type == nec_protocol.TYPE_SET_PARAMETER:
+            parameter[1] = min(int(message[4:8], 16), parameter[0])
+        return self.reply(reply_type, f'00{page:02X}{code:02X}00{parameter[0]:04X}{parameter[1]:04X}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate an NEC display on a local TCP port')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7142)
+    parser.add_argument('--monitor-id', type=int, default=1)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before each reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random delay of up to this many seconds')
+    parser.add_argument('--split', type=int, default=0, help='write replies in chunks of this many bytes')
+    parser.add_argument('--refuse-rate', type=float, default=0.0, help='share of connections reset on accept (0-1)')
+    parser.add_argument('--standby-rejects', action='store_true',
+                        help='reject parameter reads and writes unless the power is on')
+    args = parser.parse_args()
+
+    emulator = NECEmulator(args.host, args.port, args.monitor_id, args.delay, args.jitter,
+                           args.split, args.refuse_rate, args.standby_rejects)
+    port = emulator.start()
+    print(f"NEC emulator listening on {args.host}:{port}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Stats: {emulator.stats}")
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
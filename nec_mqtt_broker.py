@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Minimal MQTT broker for testing the MQTT bridge without Mosquitto
+
+Speaks just enough MQTT 3.1.1 for the service's client: CONNECT with a
+last will, SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, PUBLISH at QoS 0
+and 1 (delivered at QoS 0), retained messages and PINGREQ. Every client
+is accepted, whatever its credentials. Connections can be dropped on a
+timer to exercise the bridge's reconnect and outbound buffer; a dropped
+client's will is published like a real broker does.
+
+Usage: python3 nec_mqtt_broker.py [--port 1883] [--drop-interval 30] [--verbose]
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rootfs', 'usr', 'bin'))
+
+from nec_mqtt import (CONNECT, CONNACK, PUBLISH, SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT,
+                      MQTTClient, MQTTError, _encode_string, _packet)
+
+PUBACK = 0x40
+UNSUBSCRIBE = 0xA2  # reserved flags 0010 are mandatory
+UNSUBACK = 0xB0
+
+
+def topic_matches(topic_filter, topic):
+    """Whether topic matches a subscription filter with + and # wildcards"""
+    filter_levels = topic_filter.split('/')
+    levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(levels) or (level != '+' and level != levels[index]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+class BrokerClient:
+    """State of one connected client"""
+
+    def __init__(self, conn, address):
+        self.conn = conn
+        self.address = address
+        self.client_id = None
+        self.will = None  # (topic, payload, retain)
+        self.subscriptions = set()
+        self.send_lock = threading.Lock()
+
+    def send(self, packet):
+        with self.send_lock:
+            self.conn.sendall(packet)
+
+
+class MQTTBroker:
+    """In-process MQTT broker serving any number of clients
+
+    Retained messages are kept per topic until replaced or cleared with an
+    empty retained payload. With drop_interval set, every client
+    connection is reset that often. With verbose, each publish is printed.
+    """
+
+    def __init__(self, host='127.0.0.1', port=1883, drop_interval=0.0, verbose=False):
+        self.host = host
+        self.port = port
+        self.drop_interval = drop_interval
+        self.verbose = verbose
+        self.retained = {}
+        self.stats = {'connections': 0, 'published': 0, 'delivered': 0, 'dropped': 0, 'wills': 0}
+        self._clients = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """Start listening in a background thread and return the bound port"""
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(16)
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, name='mqtt-broker', daemon=True).start()
+        if self.drop_interval:
+            threading.Thread(target=self._drop_periodically, name='mqtt-broker-drop', daemon=True).start()
+        return self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        self.drop_clients()
+
+    def drop_clients(self):
+        """Reset every client connection, as a broker restart or network glitch would"""
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return len(clients)
+
+    def publish(self, topic, payload, retain=False):
+        """Deliver a message to every matching subscriber, keeping it if retained"""
+        with self._lock:
+            self.stats['published'] += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            targets = [client for client in self._clients
+                       if any(topic_matches(topic_filter, topic) for topic_filter in client.subscriptions)]
+        if self.verbose:
+            print(f"{topic}{' (retained)' if retain else ''}: {payload.decode('utf-8', 'replace')}")
+        packet = _packet(PUBLISH, _encode_string(topic) + payload)
+        for client in targets:
+            try:
+                client.send(packet)
+            except OSError:
+                continue
+            with self._lock:
+                self.stats['delivered'] += 1
+
+    def _drop_periodically(self):
+        while self._server is not None:
+            time.sleep(self.drop_interval)
+            dropped = self.drop_clients()
+            with self._lock:
+                self.stats['dropped'] += dropped
+
+    def _accept(self):
+        while self._server is not None:
+            try:
+                conn, address = self._server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.stats['connections'] += 1
+            threading.Thread(target=self._serve, args=(BrokerClient(conn, address),), daemon=True).start()
+
+    def _serve(self, client):
+        clean = False
+        with client.conn:
+            try:
+                header, data = MQTTClient._read_packet(client.conn)
+                if header & 0xF0 != CONNECT:
+                    return
+                self._connect(client, data)
+                with self._lock:
+                    self._clients.append(client)
+                client.send(_packet(CONNACK, b'\x00\x00'))
+                while True:
+                    header, data = MQTTClient._read_packet(client.conn)
+                    if header & 0xF0 == DISCONNECT:
+                        clean = True
+                        return
+                    self._handle(client, header, data)
+            except (OSError, MQTTError, ValueError, IndexError, struct.error):
+                return
+            finally:
+                with self._lock:
+                    if client in self._clients:
+                        self._clients.remove(client)
+                if client.will is not None and not clean:
+                    with self._lock:
+                        self.stats['wills'] += 1
+                    self.publish(*client.will)
+
+    @staticmethod
+    def _read_string(data, offset):
+        length = struct.unpack('!H', data[offset:offset + 2])[0]
+        return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+    def _connect(self, client, data):
+        _, offset = self._read_string(data, 0)  # protocol name
+        flags = data[offset + 1]
+        offset += 4  # level, flags, keepalive
+        client_id, offset = self._read_string(data, offset)
+        client.client_id = client_id.decode('utf-8', 'replace')
+        if flags & 0x04:
+            topic, offset = self._read_string(data, offset)
+            payload, offset = self._read_string(data, offset)
+            client.will = (topic.decode('utf-8'), payload, bool(flags & 0x20))
+
+    def _handle(self, client, header, data):
+        kind = header & 0xF0
+        if kind == PUBLISH:
+            qos = (header >> 1) & 0x03
+            topic, offset = self._read_string(data, 0)
+            if qos:
+                packet_id = data[offset:offset + 2]
+                offset += 2
+                client.send(_packet(PUBACK, packet_id))
+            self.publish(topic.decode('utf-8'), data[offset:], retain=bool(header & 0x01))
+        elif header == SUBSCRIBE:
+            self._subscribe(client, data)
+        elif header == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(data):
+                topic_filter, offset = self._read_string(data, offset)
+                client.subscriptions.discard(topic_filter.decode('utf-8'))
+            client.send(_packet(UNSUBACK, data[:2]))
+        elif kind == PINGREQ:
+            client.send(_packet(PINGRESP, b''))
+
+    def _subscribe(self, client, data):
+        offset, filters = 2, []
+        while offset < len(data):
+            topic_filter, offset = self._read_string(data, offset)
+            offset += 1  # requested QoS
+            filters.append(topic_filter.decode('utf-8'))
+        client.subscriptions.update(filters)
+        # Everything is delivered at QoS 0
+        client.send(_packet(SUBACK, data[:2] + bytes(len(filters))))
+        with self._lock:
+            retained = [(topic, payload) for topic, payload in self.retained.items()
+                        if any(topic_matches(topic_filter, topic) for topic_filter in filters)]
+        for topic, payload in retained:
+            client.send(_packet(PUBLISH | 0x01, _encode_string(topic) + payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a minimal MQTT broker on a local TCP port')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--drop-interval', type=float, default=0.0,
+                        help='reset every client connection this often, in seconds')
+    parser.add_argument('--verbose', action='store_true', help='print every published message')
+    args = parser.parse_args()
+
+    broker = MQTTBroker(args.host, args.port, args.drop_interval, args.verbose)
+    port = broker.start()
+    print(f"MQTT broker listening on {args.host}:{port}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Stats: {broker.stats}, retained topics: {len(broker.retained)}")
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
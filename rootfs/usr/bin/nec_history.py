@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Bounded in-memory history of display values
+
+Each HistoryRing holds the most recent samples of one value in two flat
+arrays (timestamps and values), so memory is fixed however long the
+service runs. downsample() turns the samples into fixed-width buckets
+with the last, minimum, maximum and time-weighted average value, which is
+all a dashboard or an energy report needs.
+
+A sample's value holds until the next sample, but for max_gap seconds at
+most, so a period the service wasn't running isn't counted as either
+state. NaN marks an unknown value (e.g. an unreachable display).
+"""
+
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+
+class HistoryRing:
+    """Fixed-size ring buffer of (timestamp, value) samples"""
+
+    def __init__(self, size):
+        self.size = max(1, int(size))
+        self._times = array('d', bytes(8 * self.size))
+        self._values = array('f', bytes(4 * self.size))
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, timestamp=None):
+        with self._lock:
+            self._times[self._next] = time.time() if timestamp is None else timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.size
+            self._count = min(self._count + 1, self.size)
+
+    def samples(self, since=None):
+        """(timestamps, values) in time order, starting with the last sample before since"""
+        with self._lock:
+            start = (self._next - self._count) % self.size
+            if start + self._count <= self.size:
+                times = self._times[start:start + self._count]
+                values = self._values[start:start + self._count]
+            else:
+                times = self._times[start:] + self._times[:self._next]
+                values = self._values[start:] + self._values[:self._next]
+        if since is not None:
+            first = max(bisect_right(times, since) - 1, 0)
+            times, values = times[first:], values[first:]
+        return times, values
+
+
+def downsample(times, values, since, until, step, max_gap):
+    """Summarize samples into buckets of step seconds between since and until
+
+    Returns a list of dicts with the bucket start, the number of samples
+    taken in it, and the last, min, max and time-weighted avg value (None
+    where nothing is known), plus 'known_seconds', the time covered by a
+    known value. With step = until - since the single bucket gives totals.
+    """
+    count = max(1, math.ceil((until - since) / step))
+    buckets = [{'start': since + index * step, 'samples': 0, 'last': None, 'min': None, 'max': None,
+                'weighted': 0.0, 'known_seconds': 0.0} for index in range(count)]
+    for index, timestamp in enumerate(times):
+        value = values[index]
+        known = not math.isnan(value)
+        if since <= timestamp < until:
+            bucket = buckets[int((timestamp - since) // step)]
+            bucket['samples'] += 1
+        # The value holds until the next sample, the gap limit or the end
+        end = min(times[index + 1] if index + 1 < len(times) else until, timestamp + max_gap, until)
+        start = max(timestamp, since)
+        if not known or end <= start:
+            continue
+        first, last = int((start - since) // step), min(int((end - since) // step), count - 1)
+        for bucket in buckets[first:last + 1]:
+            overlap = min(end, bucket['start'] + step) - max(start, bucket['start'])
+            if overlap <= 0:
+                continue
+            bucket['weighted'] += value * overlap
+            bucket['known_seconds'] += overlap
+            bucket['min'] = value if bucket['min'] is None else min(bucket['min'], value)
+            bucket['max'] = value if bucket['max'] is None else max(bucket['max'], value)
+            bucket['last'] = value
+    for bucket in buckets:
+        weighted = bucket.pop('weighted')
+        bucket['avg'] = weighted / bucket['known_seconds'] if bucket['known_seconds'] else None
+        bucket['known_seconds'] = round(bucket['known_seconds'], 3)
+    return buckets
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus-style metrics for the NEC TV Control service
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format. Updates take a per-series lock and a bisect, so
+recording on the hot path is cheap.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Latency buckets in seconds, from a LAN round trip up to the socket timeouts
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Series:
+    """Value of one metric for one combination of label values"""
+
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+
+class _HistogramSeries:
+    __slots__ = ('lock', 'counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        return _Series()
+
+    def _get(self, labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labelvalues, self._new_series())
+        return series
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._series.items())
+        for labelvalues, series in items:
+            yield self.name, _format_labels(self.labelnames, labelvalues), series.value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self._samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        series = self._get(labelvalues)
+        with series.lock:
+            series.value += amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def inc(self, *labelvalues, amount=1):
+        series = self._get(labelvalues)
+        with series.lock:
+            series.value += amount
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        series = self._get(labelvalues)
+        with series.lock:
+            series.value = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def _new_series(self):
+        return _HistogramSeries(len(self.buckets))
+
+    def observe(self, value, *labelvalues):
+        series = self._get(labelvalues)
+        index = bisect_left(self.buckets, value)
+        with series.lock:
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._series.items())
+        for labelvalues, series in items:
+            with series.lock:
+                counts = list(series.counts)
+                total, count = series.sum, series.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(float(bound))}"')
+                yield f'{self.name}_bucket', labels, cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Text exposition format of every registered metric"""
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# Display operations
+OPERATION_DURATION = REGISTRY.histogram(
+    'nec_tv_operation_duration_seconds',
+    'Time spent in each phase of a display operation',
+    ('display', 'operation', 'phase'))
+OPERATIONS = REGISTRY.counter(
+    'nec_tv_operations_total',
+    'Display operations by outcome',
+    ('display', 'operation', 'outcome'))
+OPERATIONS_IN_FLIGHT = REGISTRY.gauge(
+    'nec_tv_operations_in_flight',
+    'Display operations waiting for or holding the connection',
+    ('display',))
+RETRIES = REGISTRY.counter(
+    'nec_tv_retries_total',
+    'Retried attempts of display operations',
+    ('display', 'operation'))
+CONNECTION_FAILURES = REGISTRY.counter(
+    'nec_tv_connection_failures_total',
+    'Failed display connections and exchanges by exception type',
+    ('display', 'error'))
+CIRCUIT_STATE = REGISTRY.gauge(
+    'nec_tv_circuit_breaker_state',
+    'Display circuit breaker state: 0 closed, 1 half-open, 2 open',
+    ('display',))
+STATE_DISAGREEMENTS = REGISTRY.counter(
+    'nec_tv_state_disagreements_total',
+    'Confirmation reads that found a different value than the last command set',
+    ('display', 'key'))
+SCHEDULER_WAITING = REGISTRY.gauge(
+    'nec_tv_scheduler_waiting',
+    'Callers waiting for a display by scheduler lane',
+    ('display', 'lane'))
+SCHEDULER_WAIT = REGISTRY.histogram(
+    'nec_tv_scheduler_wait_seconds',
+    'Time an exchange waited for its turn, the minimum gap and the rate limit',
+    ('display', 'lane'))
+
+# HTTP front end
+HTTP_REQUESTS = REGISTRY.counter(
+    'nec_tv_http_requests_total',
+    'HTTP requests by route and status',
+    ('method', 'route', 'status'))
+HTTP_DURATION = REGISTRY.histogram(
+    'nec_tv_http_request_duration_seconds',
+    'HTTP request latency by route',
+    ('method', 'route'))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'nec_tv_http_requests_in_flight',
+    'HTTP requests currently being handled')
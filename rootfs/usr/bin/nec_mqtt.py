@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Minimal MQTT 3.1.1 client for the NEC TV Control service
+
+Supports what the service needs and nothing more: QoS 0 publish (with
+retain), QoS 0 subscriptions, a last will, keepalive pings and automatic
+reconnects. Messages published while disconnected wait in a bounded buffer
+and are sent after the next connect.
+"""
+
+import logging
+import socket
+import struct
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Control packet types (upper nibble of the fixed header)
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82  # reserved flags 0010 are mandatory
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+CONNACK_ERRORS = {
+    1: 'unacceptable protocol version',
+    2: 'identifier rejected',
+    3: 'server unavailable',
+    4: 'bad user name or password',
+    5: 'not authorized',
+}
+
+
+class MQTTError(Exception):
+    """Raised when the broker rejects the connection or breaks the protocol"""
+
+
+def _encode_length(length):
+    """Remaining length as the MQTT variable byte integer"""
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value):
+    data = value.encode('utf-8') if isinstance(value, str) else value
+    return struct.pack('!H', len(data)) + data
+
+
+def _packet(header, body):
+    return bytes([header]) + _encode_length(len(body)) + body
+
+
+class MQTTClient:
+    """Background MQTT connection with reconnects and a bounded outbound buffer
+
+    on_connect() is called after every successful (re)connect, once the
+    subscriptions are restored. on_message(topic, payload) is called from
+    the client thread for each received message.
+    """
+
+    def __init__(self, host, port=1883, client_id='nec_tv_control', username=None, password=None,
+                 keepalive=60, will=None, max_buffer=1000, on_connect=None, on_message=None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        # (topic, payload, retain) published by the broker if we vanish
+        self.will = will
+        self.on_connect = on_connect
+        self.on_message = on_message
+        self.connected = False
+        self.dropped = 0
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._buffer = deque(maxlen=max_buffer)
+        self._subscriptions = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._packet_id = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='mqtt-client', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.connected:
+            try:
+                self._send(_packet(DISCONNECT, b''))
+            except OSError:
+                pass
+        self._close()
+
+    def publish(self, topic, payload, retain=False):
+        """Publish with QoS 0, buffering the message while disconnected"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        packet = _packet(PUBLISH | (0x01 if retain else 0x00), _encode_string(topic) + payload)
+        if self.connected:
+            try:
+                self._send(packet)
+                return
+            except OSError as e:
+                logger.warning(f"MQTT publish failed, buffering: {e}")
+                self._close()
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(packet)
+
+    def subscribe(self, topic):
+        """Subscribe with QoS 0; kept across reconnects"""
+        self._subscriptions.append(topic)
+        if self.connected:
+            try:
+                self._send(self._subscribe_packet([topic]))
+            except OSError:
+                self._close()
+
+    def _subscribe_packet(self, topics):
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        body = struct.pack('!H', self._packet_id)
+        for topic in topics:
+            body += _encode_string(topic) + b'\x00'
+        return _packet(SUBSCRIBE, body)
+
+    def _send(self, packet):
+        with self._send_lock:
+            if self._sock is None:
+                raise ConnectionError("MQTT not connected")
+            self._sock.sendall(packet)
+
+    def _close(self):
+        self.connected = False
+        with self._send_lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except OSError:
+                    pass
+                self._sock = None
+
+    def _connect(self):
+        flags = 0x02  # clean session
+        payload = _encode_string(self.client_id)
+        if self.will:
+            topic, message, retain = self.will
+            flags |= 0x04 | (0x20 if retain else 0x00)
+            payload += _encode_string(topic) + _encode_string(message)
+        if self.username:
+            flags |= 0x80
+            payload += _encode_string(self.username)
+            if self.password:
+                flags |= 0x40
+                payload += _encode_string(self.password)
+        body = _encode_string('MQTT') + bytes([0x04, flags]) + struct.pack('!H', self.keepalive) + payload
+
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(_packet(CONNECT, body))
+        header, data = self._read_packet(sock)
+        if header & 0xF0 != CONNACK or len(data) < 2:
+            sock.close()
+            raise MQTTError(f"Expected CONNACK, got packet type {header >> 4}")
+        if data[1]:
+            sock.close()
+            raise MQTTError(f"Connection refused: {CONNACK_ERRORS.get(data[1], data[1])}")
+        with self._send_lock:
+            self._sock = sock
+        if self._subscriptions:
+            self._send(self._subscribe_packet(self._subscriptions))
+        self.connected = True
+        logger.info(f"Connected to MQTT broker at {self.host}:{self.port}")
+
+    @staticmethod
+    def _recv_exactly(sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionResetError("Connection closed by MQTT broker")
+            data += chunk
+        return data
+
+    @classmethod
+    def _read_packet(cls, sock):
+        header = cls._recv_exactly(sock, 1)[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = cls._recv_exactly(sock, 1)[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+            if multiplier > 128 ** 3:
+                raise MQTTError("Malformed remaining length")
+        return header, cls._recv_exactly(sock, length) if length else b''
+
+    def _flush_buffer(self):
+        while self._buffer:
+            packet = self._buffer.popleft()
+            try:
+                self._send(packet)
+            except OSError:
+                self._buffer.appendleft(packet)
+                raise
+
+    @staticmethod
+    def _decode_publish(header, data):
+        """(topic, payload) of a PUBLISH packet; raises MQTTError if it is malformed"""
+        qos = (header >> 1) & 0x03
+        try:
+            topic_length = struct.unpack('!H', data[:2])[0]
+            if len(data) < 2 + topic_length + (2 if qos else 0):
+                raise ValueError(f"{len(data)} bytes can't hold a {topic_length} byte topic")
+            topic = data[2:2 + topic_length].decode('utf-8')
+        except (struct.error, ValueError) as e:
+            raise MQTTError(f"Malformed PUBLISH: {e}") from e
+        # We only subscribe with QoS 0, but skip the packet id a broker may still send
+        return topic, data[2 + topic_length + (2 if qos else 0):]
+
+    def _handle(self, header, data):
+        if header & 0xF0 == PUBLISH:
+            try:
+                topic, payload = self._decode_publish(header, data)
+            except MQTTError as e:
+                logger.warning(f"Dropping MQTT packet: {e}")
+                return
+            if self.on_message is not None:
+                try:
+                    self.on_message(topic, payload)
+                except Exception as e:
+                    logger.error(f"MQTT message handler failed for {topic}: {e}")
+
+    def _run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self._connect()
+                backoff = 1
+                self._flush_buffer()
+                if self.on_connect is not None:
+                    self.on_connect()
+                self._loop()
+            except (OSError, MQTTError) as e:
+                if not self._stop_event.is_set():
+                    logger.warning(f"MQTT connection to {self.host}:{self.port} lost: {e}")
+            except Exception as e:
+                # Never let a bug end the client thread; reconnect instead
+                logger.error(f"MQTT client error, reconnecting: {e}", exc_info=True)
+            self._close()
+            if self._stop_event.wait(backoff):
+                return
+            backoff = min(backoff * 2, 60)
+
+    def _loop(self):
+        """Read packets until the connection drops, pinging when idle"""
+        sock = self._sock
+        sock.settimeout(self.keepalive / 2)
+        awaiting_pong = False
+        while not self._stop_event.is_set():
+            try:
+                header, data = self._read_packet(sock)
+            except socket.timeout:
+                if awaiting_pong:
+                    raise MQTTError("No PINGRESP from broker")
+                self._send(_packet(PINGREQ, b''))
+                awaiting_pong = True
+                continue
+            if header & 0xF0 == PINGRESP:
+                awaiting_pong = False
+            else:
+                self._handle(header, data)
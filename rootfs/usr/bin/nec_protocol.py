@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+NEC external control protocol codec
+
+Builds and parses the frames exchanged with NEC displays over the LAN
+control port:
+
+    SOH '0' DEST SRC TYPE LEN(2) | STX message ETX | BCC CR
+
+The message is ASCII, and so is the header except for the address of
+monitor IDs 64-100, which is a byte from 80h to A4h (handled as latin-1).
+BCC is the XOR of every byte after SOH up to and including ETX.
+"""
+
+from functools import lru_cache
+
+# Protocol framing bytes
+SOH = 0x01
+STX = 0x02
+ETX = 0x03
+CR = 0x0D
+
+# Message types (header TYPE field)
+TYPE_COMMAND = 'A'
+TYPE_COMMAND_REPLY = 'B'
+TYPE_GET_PARAMETER = 'C'
+TYPE_GET_PARAMETER_REPLY = 'D'
+TYPE_SET_PARAMETER = 'E'
+TYPE_SET_PARAMETER_REPLY = 'F'
+
+# Header SRC/DEST field for the controller
+CONTROLLER = '0'
+# Monitor ID addressing every display on the line
+ALL_MONITORS = '*'
+
+# Named display parameters as (operation code page, operation code)
+PARAMETERS = {
+    'brightness': (0x00, 0x10),
+    'contrast': (0x00, 0x12),
+    'color_temperature': (0x00, 0x54),
+    'input': (0x00, 0x60),
+    'volume': (0x00, 0x62),
+    'sharpness': (0x00, 0x8C),
+    'mute': (0x00, 0x8D),
+}
+
+# Power modes reported by the power status read command
+POWER_MODES = {
+    0x0001: 'on',
+    0x0002: 'standby',
+    0x0003: 'suspend',
+    0x0004: 'off',
+}
+POWER_MODE_VALUES = {'on': 0x0001, 'off': 0x0004}
+
+# Longest frame a display sends; anything longer without ETX is garbage
+MAX_FRAME_SIZE = 256
+
+
+class FrameError(Exception):
+    """Raised when bytes from the TV are not a valid NEC frame"""
+
+
+class ProtocolError(Exception):
+    """Raised when a well-formed reply reports an error or doesn't fit the request"""
+
+
+def bcc(data):
+    """Block check code: XOR of all bytes"""
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+
+def monitor_address(monitor_id):
+    """Header DEST character for a monitor ID (1-100) or ALL_MONITORS"""
+    if monitor_id == ALL_MONITORS:
+        return ALL_MONITORS
+    monitor_id = int(monitor_id)
+    if not 1 <= monitor_id <= 100:
+        raise ValueError(f"Monitor ID must be 1-100, got {monitor_id}")
+    # ID 1 is 'A' (41h), ID 2 is 'B' and so on, up to A4h for ID 100
+    return chr(0x40 + monitor_id)
+
+
+@lru_cache(maxsize=512)
+def build_frame(message_type, message, monitor_id=1):
+    """Build a controller-to-monitor frame around an ASCII message
+
+    Frames are cached, so fixed commands are only ever built once.
+    """
+    body = (
+        '0' + monitor_address(monitor_id) + CONTROLLER + message_type
+        + f'{len(message) + 2:02X}'
+    ).encode('latin-1')
+    body += bytes([STX]) + message.encode('ascii') + bytes([ETX])
+    return bytes([SOH]) + body + bytes([bcc(body), CR])
+
+
+def opcode(page, code):
+    """Operation code page/code (each 0-FFh) as the four hex digits of a message"""
+    if not 0 <= int(page) <= 0xFF or not 0 <= int(code) <= 0xFF:
+        raise ValueError(f"Operation code page and code must be 0-255, got {page}/{code}")
+    return f'{int(page):02X}{int(code):02X}'
+
+
+def get_parameter(page, code, monitor_id=1):
+    """Frame reading the parameter at operation code page/code"""
+    return build_frame(TYPE_GET_PARAMETER, opcode(page, code), monitor_id)
+
+
+def set_parameter(page, code, value, monitor_id=1):
+    """Frame writing value (0-FFFFh) to the parameter at page/code"""
+    if not 0 <= int(value) <= 0xFFFF:
+        raise ValueError(f"Parameter value must be 0-65535, got {value}")
+    return build_frame(TYPE_SET_PARAMETER, f'{opcode(page, code)}{int(value):04X}', monitor_id)
+
+
+def power_status_read(monitor_id=1):
+    """Frame for the power status read command (01D6h)"""
+    return build_frame(TYPE_COMMAND, '01D6', monitor_id)
+
+
+def power_control(action, monitor_id=1):
+    """Frame for the power control command (C203D6h) with action 'on' or 'off'"""
+    return build_frame(TYPE_COMMAND, f'C203D6{POWER_MODE_VALUES[action]:04X}', monitor_id)
+
+
+class Reply:
+    """Decoded reply frame from a display
+
+    For parameter replies and the power status read reply, result, page,
+    code, type, max and current are filled in. For the power control reply,
+    current holds the power mode that was set.
+    """
+
+    __slots__ = ('message_type', 'monitor', 'message', 'result', 'page', 'code', 'type', 'max', 'current', 'raw')
+
+    def __init__(self, message_type, monitor, message, raw=b''):
+        self.raw = raw
+        self.message_type = message_type
+        self.monitor = monitor
+        self.message = message
+        self.result = None
+        self.page = None
+        self.code = None
+        self.type = None
+        self.max = None
+        self.current = None
+
+    @property
+    def ok(self):
+        return self.result == 0
+
+    @property
+    def opcode(self):
+        """(page, code) the reply refers to"""
+        return self.page, self.code
+
+    def as_dict(self):
+        return {
+            'type': self.message_type,
+            'monitor': self.monitor,
+            'result': self.result,
+            'page': self.page,
+            'code': self.code,
+            'max': self.max,
+            'current': self.current,
+        }
+
+    def __repr__(self):
+        return f'Reply({self.message_type!r}, {self.message!r})'
+
+
+def parse_reply(frame):
+    """Decode a reply frame whose delimiter and BCC were already checked into a Reply
+
+    Raises FrameError if the message doesn't have the layout its type requires.
+    """
+    try:
+        header = frame[1:7].decode('latin-1')
+        message = frame[8:frame.index(ETX)].decode('ascii')
+        reply = Reply(header[3], header[2], message, bytes(frame))
+        if reply.message_type in (TYPE_GET_PARAMETER_REPLY, TYPE_SET_PARAMETER_REPLY):
+            # result(2) page(2) code(2) type(2) max(4) current(4)
+            reply.result = int(message[0:2], 16)
+            reply.page = int(message[2:4], 16)
+            reply.code = int(message[4:6], 16)
+            if reply.ok:
+                reply.type = int(message[6:8], 16)
+                reply.max = int(message[8:12], 16)
+                reply.current = int(message[12:16], 16)
+        elif reply.message_type == TYPE_COMMAND_REPLY and message.startswith('02') and message[4:6] == 'D6':
+            # Power status read: '02' result(2) 'D6' type(2) max(4) current(4)
+            reply.result = int(message[2:4], 16)
+            reply.page, reply.code = 0x01, 0xD6
+            if reply.ok:
+                reply.type = int(message[6:8], 16)
+                reply.max = int(message[8:12], 16)
+                reply.current = int(message[12:16], 16)
+        elif reply.message_type == TYPE_COMMAND_REPLY and message[2:8] == 'C203D6':
+            # Power control: result(2) 'C203D6' mode(4)
+            reply.result = int(message[0:2], 16)
+            reply.current = int(message[8:12], 16)
+        else:
+            reply.result = int(message[0:2], 16)
+    except (ValueError, IndexError) as e:
+        raise FrameError(f"Malformed reply {frame.hex()}: {e}") from e
+    return reply
+
+
+def parse_command(frame):
+    """Decode a controller-to-monitor frame into a dict, e.g. for tracing
+
+    Parameter frames get page, code and (for sets) value; other commands
+    only their raw message. Raises FrameError on a malformed frame.
+    """
+    try:
+        header = frame[1:7].decode('latin-1')
+        message = frame[8:frame.index(ETX)].decode('ascii')
+        fields = {'type': header[3], 'monitor': header[1], 'message': message}
+        if fields['type'] in (TYPE_GET_PARAMETER, TYPE_SET_PARAMETER):
+            fields['page'] = int(message[0:2], 16)
+            fields['code'] = int(message[2:4], 16)
+            if fields['type'] == TYPE_SET_PARAMETER:
+                fields['value'] = int(message[4:8], 16)
+    except (ValueError, IndexError) as e:
+        raise FrameError(f"Malformed command {frame.hex()}: {e}") from e
+    return fields
+
+
+class FrameDecoder:
+    """Incremental decoder turning a byte stream into validated replies
+
+    Feed it chunks as they are received; it returns every complete reply
+    and keeps a trailing partial frame for the next chunk, so a reply split
+    over several reads or several replies in one read decode correctly.
+    Corrupt frames are dropped and counted. The buffer never grows beyond
+    MAX_FRAME_SIZE, so memory per connection stays constant.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self.errors = 0
+        self.last_error = None
+
+    def __len__(self):
+        """Number of buffered bytes of an incomplete frame"""
+        return len(self._buffer)
+
+    def reset(self):
+        """Discard any buffered partial frame"""
+        del self._buffer[:]
+
+    def feed(self, data):
+        """Add received bytes and return the list of Reply objects now complete"""
+        buffer = self._buffer
+        buffer += data
+        replies = []
+        while True:
+            start = buffer.find(SOH)
+            if start == -1:
+                # No frame start - nothing worth keeping
+                del buffer[:]
+                break
+            if start:
+                del buffer[:start]
+            etx_pos = buffer.find(ETX)
+            if etx_pos == -1 or len(buffer) < etx_pos + 3:
+                if len(buffer) > self.max_frame_size:
+                    self._drop(FrameError(f"Frame exceeds {self.max_frame_size} bytes without ETX"))
+                    # Resync on the next SOH
+                    del buffer[:1]
+                    continue
+                break
+            frame = bytes(buffer[:etx_pos + 3])
+            del buffer[:etx_pos + 3]
+            try:
+                if frame[-1] != CR:
+                    raise FrameError(f"Missing CR delimiter in frame {frame.hex()}")
+                expected = bcc(frame[1:-2])
+                if expected != frame[-2]:
+                    raise FrameError(f"BCC mismatch in frame {frame.hex()} (expected {expected:02x})")
+                replies.append(parse_reply(frame))
+            except FrameError as e:
+                self._drop(e)
+        return replies
+
+    def _drop(self, error):
+        self.errors += 1
+        self.last_error = error
+
+
+def expect_parameter(reply, page, code):
+    """Check a get/set parameter reply refers to page/code and succeeded"""
+    if reply.message_type not in (TYPE_GET_PARAMETER_REPLY, TYPE_SET_PARAMETER_REPLY):
+        raise ProtocolError(f"Expected a parameter reply, got {reply!r}")
+    if reply.opcode != (page, code):
+        raise ProtocolError(f"Reply for {reply.page:02X}{reply.code:02X} does not match request {page:02X}{code:02X}")
+    if not reply.ok:
+        raise ProtocolError(f"Parameter {page:02X}{code:02X} not supported (result {reply.result:02X})")
+    return reply
+
+
+def power_state(reply):
+    """Power state name from a power status read reply"""
+    if reply.opcode != (0x01, 0xD6):
+        raise ProtocolError(f"Expected a power status reply, got {reply!r}")
+    if not reply.ok:
+        raise ProtocolError(f"Power status read failed (result {reply.result:02X})")
+    return POWER_MODES.get(reply.current, 'unknown')
+
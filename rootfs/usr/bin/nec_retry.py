@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Retry policies and circuit breakers for NEC display operations
+
+A RetryPolicy runs an operation until it succeeds, the attempt limit is
+reached or the deadline passes, sleeping with exponential backoff and full
+jitter in between. Failures are classified so each policy decides what is
+worth retrying: a refused connection or a lost reply usually clears up on
+its own, a reply the display rejected does not.
+
+A CircuitBreaker tracks whether a display is reachable at all, so calls to
+one that is unplugged fail at once instead of waiting out timeouts.
+"""
+
+import random
+import socket
+import threading
+import time
+
+from nec_protocol import FrameError, ProtocolError
+
+# Failure classes
+REFUSED = 'refused'        # display refused the TCP connection (busy or booting)
+TIMEOUT = 'timeout'        # connect timed out or no reply arrived
+CORRUPT = 'corrupt'        # reply failed the BCC check or was malformed
+CONNECTION = 'connection'  # connection reset, broken pipe, unreachable host
+REJECTED = 'rejected'      # display answered with an error result
+DEADLINE = 'deadline'      # no time left to try (again)
+UNAVAILABLE = 'unavailable'  # circuit breaker is open, nothing was sent
+ERROR = 'error'            # anything else, e.g. a bug
+
+TRANSIENT = (REFUSED, TIMEOUT, CORRUPT, CONNECTION)
+# Failures suggesting the display can't be reached at all
+UNREACHABLE = (REFUSED, TIMEOUT, CONNECTION)
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of contacting a display whose circuit breaker is open"""
+
+
+def classify(error):
+    """Failure class of an exception raised by a display operation"""
+    if isinstance(error, CircuitOpenError):
+        return UNAVAILABLE
+    if isinstance(error, ConnectionRefusedError):
+        return REFUSED
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, FrameError):
+        return CORRUPT
+    if isinstance(error, ProtocolError):
+        return REJECTED
+    if isinstance(error, OSError):
+        return CONNECTION
+    return ERROR
+
+
+class RetryError(Exception):
+    """Raised when an operation failed on every attempt it was allowed
+
+    attempts is the number of attempts made, error_class the failure class
+    of the last one and last_error its exception (None if the deadline
+    passed before the first attempt).
+    """
+
+    def __init__(self, message, attempts, error_class, last_error=None):
+        super().__init__(message)
+        self.attempts = attempts
+        self.error_class = error_class
+        self.last_error = last_error
+
+
+class RetryPolicy:
+    """Attempt limit, backoff and deadline for one kind of operation
+
+    attempt_timeout caps how long a single attempt may wait for the display;
+    it is shortened to whatever is left of the deadline.
+    """
+
+    def __init__(self, attempts=3, base_delay=0.25, max_delay=2.0, deadline=10.0,
+                 attempt_timeout=3.0, retry_on=TRANSIENT):
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.retry_on = frozenset(retry_on)
+
+    def replace(self, **changes):
+        """Copy of this policy with some settings changed"""
+        settings = dict(attempts=self.attempts, base_delay=self.base_delay, max_delay=self.max_delay,
+                        deadline=self.deadline, attempt_timeout=self.attempt_timeout, retry_on=self.retry_on)
+        settings.update(changes)
+        return RetryPolicy(**settings)
+
+    def backoff(self, retry):
+        """Sleep before retry number retry (1 for the first), with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+    def run(self, operation, deadline=None, on_retry=None):
+        """Call operation(timeout) until it succeeds; return (result, attempts)
+
+        deadline is an absolute time.monotonic() value, by default the
+        policy's deadline from now; an earlier caller deadline wins.
+        on_retry(attempt, error_class, error, delay) is called before each
+        backoff sleep. Raises RetryError when giving up.
+        """
+        own_deadline = time.monotonic() + self.deadline
+        deadline = own_deadline if deadline is None else min(deadline, own_deadline)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RetryError("Deadline passed before the operation could run", attempt, DEADLINE)
+            attempt += 1
+            try:
+                return operation(min(self.attempt_timeout, remaining)), attempt
+            except Exception as e:
+                error_class = classify(e)
+                if error_class not in self.retry_on or attempt >= self.attempts:
+                    raise RetryError(f"{error_class} after {attempt} attempt(s): {e}", attempt, error_class, e) from e
+                delay = self.backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise RetryError(f"{error_class} after {attempt} attempt(s), deadline reached: {e}",
+                                     attempt, error_class, e) from e
+                if on_retry is not None:
+                    on_retry(attempt, error_class, e, delay)
+                time.sleep(delay)
+
+
+class CircuitBreaker:
+    """Per-display breaker that stops calls after repeated connection failures
+
+    closed: calls go through. failure_threshold consecutive unreachable
+    failures open the breaker, and allow() refuses every call. A call is
+    one operation: record its outcome once, after any retries. The owner
+    then probes the display in the background: half_open() marks a probe in
+    progress, and its record_success() closes the breaker again while a
+    record_failure() reopens it. on_change(old, new) is called after every
+    state change.
+    """
+
+    def __init__(self, failure_threshold=3, on_change=None):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.last_error = None
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return self.state == CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            previous = self._set(CLOSED)
+        self._notify(previous)
+
+    def record_failure(self, error_class, error=None):
+        """Count a failed call; failures other than UNREACHABLE ones are ignored"""
+        if error_class not in UNREACHABLE:
+            return
+        with self._lock:
+            self.failures += 1
+            self.last_error = f'{error_class}: {error}' if error is not None else error_class
+            previous = None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                previous = self._set(OPEN)
+        self._notify(previous)
+
+    def half_open(self):
+        with self._lock:
+            previous = self._set(HALF_OPEN) if self.state == OPEN else None
+        self._notify(previous)
+
+    def as_dict(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'since_seconds': round(time.monotonic() - self._changed_at, 1),
+            'last_error': self.last_error,
+        }
+
+    def _set(self, state):
+        """Switch state under the lock; returns the old state if it changed"""
+        if state == self.state:
+            return None
+        previous, self.state = self.state, state
+        self._changed_at = time.monotonic()
+        return previous
+
+    def _notify(self, previous):
+        if previous is not None and self.on_change is not None:
+            self.on_change(previous, self.state)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Per-display scheduling of exchanges with NEC displays
+
+The panels only manage a few commands a second and become unreliable when
+they are hit back to back. A DisplayScheduler sits in front of each
+display: one exchange at a time, at least min_gap seconds after the
+previous one ended, and on average no more than rate a second with bursts
+of up to burst (a token bucket). Callers waiting for the display are
+served by lane - user commands first, then parameter sets, then
+background polling - and in arrival order within a lane.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Lanes, highest priority first
+LANE_USER = 'user'
+LANE_SET = 'set'
+LANE_POLL = 'poll'
+LANES = (LANE_USER, LANE_SET, LANE_POLL)
+
+_context = threading.local()
+
+
+@contextmanager
+def background():
+    """Run display I/O of the current thread in the poll lane"""
+    previous = getattr(_context, 'background', False)
+    _context.background = True
+    try:
+        yield
+    finally:
+        _context.background = previous
+
+
+def lane_for(operation):
+    """Lane of an exchange for operation ('power_set', 'brightness_get', ...) made by this thread"""
+    if getattr(_context, 'background', False):
+        return LANE_POLL
+    if operation.endswith('_set') and operation != 'power_set':
+        return LANE_SET
+    return LANE_USER
+
+
+class DisplayScheduler:
+    """Token bucket, minimum gap and priority lanes in front of one display
+
+    turn(lane) waits until the display is free and no caller of a higher
+    lane (or earlier in the same lane) is waiting, then holds it; the
+    owner may nest turns, e.g. to run several exchanges as one session.
+    Inside a turn, pace() waits for the gap and a token before each
+    exchange, and finished() marks its end. on_waiting(lane, count) is
+    called whenever the number of callers waiting in a lane changes.
+    """
+
+    def __init__(self, rate=10.0, burst=5, min_gap=0.05, on_waiting=None):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, int(burst))
+        self.min_gap = max(0.0, min_gap)
+        self.on_waiting = on_waiting
+        self._cond = threading.Condition()
+        self._owner = None
+        self._depth = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._last_end = float('-inf')
+        self._last_foreground = float('-inf')
+        self._waiting = {lane: [] for lane in LANES}
+        self._stats = {lane: {'exchanges': 0, 'wait_total': 0.0, 'wait_max': 0.0} for lane in LANES}
+
+    @contextmanager
+    def turn(self, lane):
+        """Hold the display; yields the seconds spent waiting for it"""
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                waited = 0.0
+            else:
+                waited = self._wait_turn(lane, me)
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._owner = None
+                    self._cond.notify_all()
+
+    def _wait_turn(self, lane, me):
+        started = time.monotonic()
+        ticket = object()
+        queue = self._waiting[lane]
+        queue.append(ticket)
+        self._notify_waiting(lane)
+        try:
+            while self._owner is not None or not self._is_next(lane, ticket):
+                self._cond.wait()
+        finally:
+            queue.remove(ticket)
+            self._notify_waiting(lane)
+            # Whoever is next may have been waiting behind this ticket
+            self._cond.notify_all()
+        self._owner = me
+        self._depth = 1
+        return time.monotonic() - started
+
+    def _is_next(self, lane, ticket):
+        for other in LANES:
+            if self._waiting[other]:
+                return other == lane and self._waiting[lane][0] is ticket
+        return False
+
+    def _notify_waiting(self, lane):
+        if self.on_waiting is not None:
+            self.on_waiting(lane, len(self._waiting[lane]))
+
+    def pace(self, lane, waited=0.0):
+        """Wait for the gap and a token before an exchange; returns the total wait
+
+        waited is the time already spent in turn(), counted into the lane's
+        wait statistics together with the pacing delay.
+        """
+        with self._cond:
+            started = time.monotonic()
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                delay = max(self._last_end + self.min_gap - now, (1 - self._tokens) / self.rate)
+                if delay <= 0:
+                    break
+                self._cond.wait(delay)
+            self._tokens -= 1
+            if lane != LANE_POLL:
+                self._last_foreground = now
+            waited += now - started
+            stats = self._stats[lane]
+            stats['exchanges'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+        return waited
+
+    def finished(self):
+        """Mark the end of an exchange; the gap is counted from here"""
+        with self._cond:
+            self._last_end = time.monotonic()
+
+    def foreground_idle(self):
+        """Seconds since the last exchange outside the poll lane"""
+        return time.monotonic() - self._last_foreground
+
+    def stats(self):
+        with self._cond:
+            lanes = {
+                lane: {
+                    'waiting': len(self._waiting[lane]),
+                    'exchanges': stats['exchanges'],
+                    'wait_ms_avg': round(stats['wait_total'] / stats['exchanges'] * 1000, 1) if stats['exchanges'] else 0.0,
+                    'wait_ms_max': round(stats['wait_max'] * 1000, 1),
+                }
+                for lane, stats in self._stats.items()
+            }
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'min_gap_ms': round(self.min_gap * 1000, 1),
+                'tokens': round(min(self.burst, self._tokens + (time.monotonic() - self._refilled) * self.rate), 2),
+                'lanes': lanes,
+            }
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Snapshot of display state kept on disk across restarts
+
+The service writes each display's last known state, probed capabilities
+and measured reply time to a small JSON file, and loads it at startup so
+the first requests after a restart are answered from a warm cache instead
+of waiting on the panel. Writes replace the file atomically, so a crash
+mid-write leaves the previous snapshot intact, and are rate limited: a
+burst of changes costs one write.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """Rate-limited, atomic JSON snapshot file
+
+    mark_dirty() asks for a write; the background thread then calls
+    collect() and writes its result at most once every interval seconds,
+    skipping writes that would not change the file. flush() writes at once.
+    """
+
+    def __init__(self, path, interval=30.0):
+        self.path = path
+        self.interval = interval
+        self.writes = 0
+        self._collect = None
+        self._dirty = threading.Event()
+        self._lock = threading.Lock()
+        self._last_content = None
+        self._last_write = float('-inf')
+
+    def load(self):
+        """Return the saved snapshot's displays, or {} if there is none usable"""
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return {}
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring snapshot {self.path} with unknown version")
+            return {}
+        displays = snapshot.get('displays')
+        return displays if isinstance(displays, dict) else {}
+
+    def start(self, collect):
+        """Start writing collect()'s result (the displays dict) when marked dirty"""
+        self._collect = collect
+        threading.Thread(target=self._run, name='snapshot-writer', daemon=True).start()
+
+    def mark_dirty(self):
+        self._dirty.set()
+
+    def flush(self):
+        """Write the current snapshot now, e.g. on shutdown"""
+        if self._collect is not None:
+            self._dirty.clear()
+            self._save()
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            # Coalesce everything that changes until the interval is up
+            time.sleep(max(0.0, self._last_write + self.interval - time.monotonic()))
+            self._dirty.clear()
+            self._save()
+
+    def _save(self):
+        try:
+            self._write(self._collect())
+        except Exception as e:
+            logger.warning(f"Writing snapshot {self.path} failed: {e}")
+
+    def _write(self, displays):
+        content = json.dumps({'version': SNAPSHOT_VERSION, 'saved_at': time.time(), 'displays': displays},
+                             sort_keys=True, indent=1)
+        with self._lock:
+            # saved_at always differs, so compare what matters
+            comparable = json.dumps(displays, sort_keys=True)
+            if comparable == self._last_content:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+            self._last_content = comparable
+            self._last_write = time.monotonic()
+            self.writes += 1
@@ -3,82 +3,1559 @@
 NEC TV Control Service for Home Assistant
 """
 
+import gzip
+import hashlib
+import math
 import os
+import select
+import signal
 import socket
+import threading
 import time
+import uuid
+from contextlib import contextmanager
 import json
 import logging
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import queue
+from functools import partial
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+import nec_protocol
+from nec_mqtt import MQTTClient
+from nec_metrics import (
+    REGISTRY, OPERATION_DURATION, OPERATIONS, OPERATIONS_IN_FLIGHT, RETRIES,
+    CONNECTION_FAILURES, CIRCUIT_STATE, STATE_DISAGREEMENTS, SCHEDULER_WAIT, SCHEDULER_WAITING, HTTP_REQUESTS, HTTP_DURATION, HTTP_IN_FLIGHT,
+)
+from nec_protocol import FrameError, PARAMETERS
+from nec_history import HistoryRing, downsample
+from nec_scheduler import DisplayScheduler, background, lane_for, LANE_SET
+from nec_snapshot import SnapshotStore
+from nec_retry import (
+    CircuitBreaker, CircuitOpenError, RetryError, RetryPolicy, classify,
+    CLOSED, HALF_OPEN, OPEN, CORRUPT, REJECTED, UNAVAILABLE,
+)
+
+# Configure logging; LOG_LEVEL takes the add-on's log_level values
+LOG_LEVELS = {
+    'trace': logging.DEBUG,
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'notice': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'fatal': logging.CRITICAL,
+}
+logging.basicConfig(level=LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'info').lower(), logging.INFO))
 logger = logging.getLogger(__name__)
 
 # Configuration
 TV_IP = os.environ.get('TV_IP', '192.168.1.150')
 TV_PORT = int(os.environ.get('TV_PORT', 7142))
+TV_IDLE_TIMEOUT = float(os.environ.get('TV_IDLE_TIMEOUT', 30))
+# Seconds between background state refreshes (0 disables the poller)
+POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', 15))
+# Optional list of displays as JSON: [{"id": "lobby", "ip": "...", "port": 7142, "monitor_id": 1}].
+# When empty, the single display from TV_IP/TV_PORT is used.
+DISPLAYS = json.loads(os.environ.get('DISPLAYS') or '[]')
+# MQTT bridge, enabled when MQTT_HOST is set
+MQTT_HOST = os.environ.get('MQTT_HOST', '')
+MQTT_PORT = int(os.environ.get('MQTT_PORT') or 1883)
+MQTT_USERNAME = os.environ.get('MQTT_USERNAME', '')
+MQTT_PASSWORD = os.environ.get('MQTT_PASSWORD', '')
+MQTT_TOPIC_PREFIX = os.environ.get('MQTT_TOPIC_PREFIX') or 'nec_tv'
+MQTT_DISCOVERY_PREFIX = os.environ.get('MQTT_DISCOVERY_PREFIX') or 'homeassistant'
+# Seconds an idle HTTP keep-alive connection is held open
+HTTP_IDLE_TIMEOUT = float(os.environ.get('HTTP_IDLE_TIMEOUT', 60))
+# Open client connections above which responses close the connection
+HTTP_MAX_KEEPALIVE = int(os.environ.get('HTTP_MAX_KEEPALIVE', 32))
+# Consecutive operations failing to reach a display (after their retries) that mark it unavailable
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 3))
+# Seconds between background probes of an unavailable display, doubling up to the maximum
+BREAKER_PROBE_INTERVAL = float(os.environ.get('BREAKER_PROBE_INTERVAL', 5))
+BREAKER_PROBE_MAX_INTERVAL = float(os.environ.get('BREAKER_PROBE_MAX_INTERVAL', 60))
+# Per-display rate limit: commands per second on average, burst size, and
+# minimum seconds between the end of one exchange and the next command
+SCHEDULER_RATE = float(os.environ.get('SCHEDULER_RATE', 10))
+SCHEDULER_BURST = int(os.environ.get('SCHEDULER_BURST', 5))
+SCHEDULER_MIN_GAP = float(os.environ.get('SCHEDULER_MIN_GAP', 0.05))
+# Background polls wait until user traffic has been quiet this many seconds,
+# but are put off by one poll interval at most
+POLL_BACKOFF = float(os.environ.get('POLL_BACKOFF', 5))
+# Samples of power and brightness kept per display for /history (about a
+# week at the default poll interval)
+HISTORY_SIZE = int(os.environ.get('HISTORY_SIZE', 40320))
+# Largest number of buckets one /history request may ask for
+HISTORY_MAX_BUCKETS = 2000
+# Number of recent frames kept for /debug/frames
+FRAME_TRACE_SIZE = int(os.environ.get('FRAME_TRACE_SIZE', 256))
+# Asynchronous command jobs kept for GET /jobs/<id>, and seconds a finished one is kept
+JOB_HISTORY_SIZE = int(os.environ.get('JOB_HISTORY_SIZE', 256))
+JOB_TTL = float(os.environ.get('JOB_TTL', 300))
+# Snapshot of display state for warm restarts (empty disables), written at most every SNAPSHOT_INTERVAL seconds
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '/share/hass-nec-control/snapshot.json')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 30))
+# Seconds a restored value is served without a read, however the poller is set up
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', 3600))
+
+# Values the background poller keeps fresh; other parameters are read on demand
+POLLED_KEYS = ('power', 'brightness')
+
+# Seconds between keepalive comments on idle event streams
+EVENT_KEEPALIVE = 15
 
-# NEC TV Commands (hex format) - FIXED WORKING COMMANDS
-COMMANDS = {
-    'power_on': b'\x01\x30\x41\x30\x41\x30\x43\x02\x43\x32\x30\x33\x44\x36\x30\x30\x30\x31\x03\x73\x0D',
-    'power_off': b'\x01\x30\x41\x30\x41\x30\x43\x02\x43\x32\x30\x33\x44\x36\x30\x30\x30\x34\x03\x76\x0D'
+# Retry policy per display operation, keyed like the operation metric label
+DEFAULT_RETRY_POLICIES = {
+    # Power commands are idempotent, and a panel coming out of standby can
+    # take a few seconds to answer
+    'power_set': RetryPolicy(attempts=4, base_delay=0.5, max_delay=4.0, deadline=20.0, attempt_timeout=5.0),
+    'power_query': RetryPolicy(attempts=2, deadline=6.0),
+    'brightness_get': RetryPolicy(attempts=2, deadline=6.0),
+    'brightness_set': RetryPolicy(attempts=3, deadline=10.0),
+    'parameter_get': RetryPolicy(attempts=2, deadline=6.0),
+    'parameter_set': RetryPolicy(attempts=3, deadline=10.0),
 }
+# Settings a retry policy override may change
+RETRY_SETTINGS = ('attempts', 'base_delay', 'max_delay', 'deadline', 'attempt_timeout')
 
-class NECTVHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for NEC TV control"""
-    
-    def do_GET(self):
-        """Handle GET requests for device discovery"""
-        parsed_url = urlparse(self.path)
-        
-        if parsed_url.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            response = {
-                'name': 'NEC TV Control',
-                'version': '1.0.9',
-                'tv_ip': TV_IP,
-                'tv_port': TV_PORT
+
+def load_retry_policies(raw):
+    """Default retry policies with the overrides in the JSON string raw applied
+
+    raw is an object keyed by operation, e.g. {"power_set": {"attempts": 5}},
+    or the add-on option's list, e.g. [{"operation": "power_set", "attempts": 5}].
+    Unknown operations and settings and bad values are logged and ignored,
+    so a typo leaves the default in place instead of stopping the service.
+    """
+    policies = dict(DEFAULT_RETRY_POLICIES)
+    try:
+        overrides = json.loads(raw or '{}')
+    except ValueError as e:
+        logger.warning(f"Ignoring retry policies, not valid JSON: {e}")
+        return policies
+    if isinstance(overrides, list):
+        entries, overrides = overrides, {}
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get('operation'), str):
+                logger.warning(f"Ignoring retry policy without an operation: {entry!r}")
+                continue
+            settings = dict(entry)
+            overrides[settings.pop('operation')] = settings
+    if not isinstance(overrides, dict):
+        logger.warning(f"Ignoring retry policies, expected an object or a list: {overrides!r}")
+        return policies
+    for name, settings in overrides.items():
+        if name not in policies:
+            logger.warning(f"Ignoring retry policy for unknown operation {name!r} (one of {', '.join(policies)})")
+            continue
+        if not isinstance(settings, dict):
+            logger.warning(f"Ignoring retry policy {name}, expected an object: {settings!r}")
+            continue
+        changes = {}
+        for setting, value in settings.items():
+            if setting not in RETRY_SETTINGS:
+                logger.warning(f"Ignoring unknown retry setting {name}.{setting} (one of {', '.join(RETRY_SETTINGS)})")
+                continue
+            # Delays may be 0; attempts must be a whole number
+            positive = setting in ('attempts', 'deadline', 'attempt_timeout')
+            if (isinstance(value, bool) or not isinstance(value, (int, float))
+                    or not (value > 0 if positive else value >= 0)
+                    or (setting == 'attempts' and value != int(value))):
+                logger.warning(f"Ignoring retry setting {name}.{setting}, invalid value {value!r}")
+                continue
+            changes[setting] = value
+        if changes:
+            policies[name] = policies[name].replace(**changes)
+            logger.info(f"Retry policy {name}: {changes}")
+    return policies
+
+
+RETRY_POLICIES = load_retry_policies(os.environ.get('RETRY_POLICIES'))
+# Parameter name by (page, code)
+PARAMETER_NAMES = {opcode: name for name, opcode in PARAMETERS.items()}
+
+# Seconds after a command before its value is confirmed by reading it back.
+# Panels report the old power state for a while during power transitions;
+# parameters settle within a couple of seconds.
+CONFIRM_DELAYS = dict({name: 2.0 for name in PARAMETERS}, power=10.0)
+
+# Weight of the newest sample in a display's smoothed reply time
+REPLY_TIME_SMOOTHING = 0.2
+
+# Circuit breaker states as exported by the nec_tv_circuit_breaker_state gauge
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class FrameTrace:
+    """Fixed-size ring buffer of the frames recently sent to and received from displays
+
+    Recording only stores the raw bytes; frames are decoded when the trace
+    is read, so tracing costs next to nothing per exchange.
+    """
+
+    def __init__(self, size=FRAME_TRACE_SIZE):
+        self._frames = deque(maxlen=max(1, size))
+
+    def record(self, display, direction, operation, frame=None, round_trip=None, error=None):
+        """Add a 'tx' or 'rx' entry; an rx entry without a frame records a missing or corrupt reply"""
+        self._frames.append((time.time(), display, direction, operation, frame, round_trip, error))
+
+    def entries(self, display=None, limit=None):
+        """Decoded entries, oldest first, optionally for one display and only the last limit"""
+        frames = [entry for entry in list(self._frames) if display is None or entry[1] == display]
+        if limit is not None:
+            frames = frames[-limit:] if limit > 0 else []
+        return [self._decode(*entry) for entry in frames]
+
+    @staticmethod
+    def _decode(timestamp, display, direction, operation, frame, round_trip, error):
+        entry = {
+            'timestamp': round(timestamp, 6),
+            'display': display,
+            'direction': direction,
+            'operation': operation,
+            'frame': frame.hex() if frame is not None else None,
+        }
+        if frame is not None:
+            try:
+                entry['decoded'] = (nec_protocol.parse_command(frame) if direction == 'tx'
+                                    else nec_protocol.parse_reply(frame).as_dict())
+            except FrameError as e:
+                entry['decoded'] = None
+                error = error or str(e)
+        if round_trip is not None:
+            entry['round_trip_ms'] = round(round_trip * 1000, 3)
+        if error is not None:
+            entry['error'] = error
+        return entry
+
+
+FRAMES = FrameTrace()
+
+
+class TVConnection:
+    """Long-lived TCP connection to a single NEC display
+
+    The socket is opened lazily on first use and kept open between requests,
+    because the panel is slow to accept connections and tends to refuse rapid
+    reconnects. The scheduler spaces and rate limits the commands and decides
+    whose turn is next; the lock guarantees only one request is in flight.
+    """
+
+    def __init__(self, host, port, name=None, idle_timeout=TV_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        # Display label used in metrics
+        self.name = name or f'{host}:{port}'
+        self.idle_timeout = idle_timeout
+        self.lock = threading.RLock()
+        self.scheduler = DisplayScheduler(
+            SCHEDULER_RATE, SCHEDULER_BURST, SCHEDULER_MIN_GAP,
+            on_waiting=lambda lane, count: SCHEDULER_WAITING.set(count, self.name, lane))
+        self._sock = None
+        self._decoder = nec_protocol.FrameDecoder()
+        self._last_used = 0.0
+        self._parse_time = 0.0
+        # Smoothed seconds from sending a command to its reply, None until measured
+        self.reply_time = None
+
+    def _is_healthy(self):
+        """Check that the open socket is still usable without blocking"""
+        if self._sock is None:
+            return False
+        if time.monotonic() - self._last_used > self.idle_timeout:
+            return False
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if readable:
+                # Either the display closed the connection or sent something
+                # unsolicited - drop stale bytes so they aren't read as a reply
+                self._sock.setblocking(False)
+                try:
+                    if not self._sock.recv(1024):
+                        return False
+                finally:
+                    self._sock.setblocking(True)
+        except OSError:
+            return False
+        return True
+
+    def _connect(self, timeout):
+        logger.info("Connecting to TV at %s:%s", self.host, self.port)
+        sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._sock = sock
+
+    def close(self):
+        """Close the socket; the next request reconnects"""
+        with self.lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except OSError:
+                    pass
+                self._sock = None
+                logger.info("Connection to TV at %s:%s closed", self.host, self.port)
+
+    def close_if_idle(self):
+        """Close the socket if it has not been used within the idle timeout"""
+        # Don't wait behind an in-flight request, it is clearly not idle
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self._sock is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                self.close()
+        finally:
+            self.lock.release()
+
+    def _read_reply(self, deadline):
+        """Read until a complete reply arrives or the deadline passes
+
+        Returns the decoded Reply, or None on timeout. The reply may arrive
+        split over several TCP segments; the decoder buffers partial frames.
+        Raises FrameError if only corrupt frames were received.
+        """
+        errors = self._decoder.errors
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._sock.settimeout(remaining)
+            try:
+                chunk = self._sock.recv(1024)
+            except socket.timeout:
+                break
+            if not chunk:
+                raise ConnectionResetError("Connection closed by TV")
+            parse_started = time.perf_counter()
+            replies = self._decoder.feed(chunk)
+            self._parse_time += time.perf_counter() - parse_started
+            if replies:
+                # Strict request/response: anything after the first reply is stale
+                self._decoder.reset()
+                return replies[0]
+        if self._decoder.errors != errors:
+            raise self._decoder.last_error
+        return None
+
+    def exchange(self, command, timeout=3, operation='command'):
+        """Send a frame and return the decoded Reply (None if the TV sent none)
+
+        Returns as soon as a complete, checksummed reply has arrived rather
+        than after a fixed delay. A reused socket that turns out to be dead
+        is reconnected and the command is sent once more. Errors on a fresh
+        connection are raised. operation labels the metrics recorded for
+        the connect, send, wait and parse phases.
+        """
+        OPERATIONS_IN_FLIGHT.inc(self.name)
+        started = time.perf_counter()
+        outcome = 'error'
+        lane = lane_for(operation)
+        try:
+            with self.scheduler.turn(lane) as waited, self.lock:
+                SCHEDULER_WAIT.observe(self.scheduler.pace(lane, waited), self.name, lane)
+                try:
+                    reply = self._exchange(command, timeout, operation)
+                finally:
+                    self.scheduler.finished()
+            outcome = 'ok' if reply is not None else 'timeout'
+            return reply
+        except Exception as e:
+            CONNECTION_FAILURES.inc(self.name, type(e).__name__)
+            raise
+        finally:
+            OPERATIONS_IN_FLIGHT.dec(self.name)
+            OPERATIONS.inc(self.name, operation, outcome)
+            OPERATION_DURATION.observe(time.perf_counter() - started, self.name, operation, 'total')
+
+    @contextmanager
+    def session(self, lane=None):
+        """Hold the display for several exchanges in a row
+
+        Other callers wait until the session ends; the exchanges inside it
+        are still paced by the scheduler.
+        """
+        with self.scheduler.turn(lane or lane_for('')), self.lock:
+            yield
+
+    def _exchange(self, command, timeout, operation):
+        for attempt in range(2):
+            reused = self._is_healthy()
+            if not reused:
+                self.close()
+                phase_started = time.perf_counter()
+                self._connect(timeout)
+                OPERATION_DURATION.observe(time.perf_counter() - phase_started, self.name, operation, 'connect')
+            try:
+                self._decoder.reset()
+                self._sock.settimeout(timeout)
+                phase_started = time.perf_counter()
+                self._sock.sendall(command)
+                sent = time.perf_counter()
+                FRAMES.record(self.name, 'tx', operation, command)
+                OPERATION_DURATION.observe(sent - phase_started, self.name, operation, 'send')
+                self._parse_time = 0.0
+                reply = self._read_reply(time.monotonic() + timeout)
+                waited = time.perf_counter() - sent - self._parse_time
+                OPERATION_DURATION.observe(waited, self.name, operation, 'wait')
+                OPERATION_DURATION.observe(self._parse_time, self.name, operation, 'parse')
+                if reply is not None:
+                    FRAMES.record(self.name, 'rx', operation, reply.raw, waited)
+                    self._last_used = time.monotonic()
+                    self.reply_time = waited if self.reply_time is None else (
+                        REPLY_TIME_SMOOTHING * waited + (1 - REPLY_TIME_SMOOTHING) * self.reply_time)
+                else:
+                    FRAMES.record(self.name, 'rx', operation, round_trip=waited, error='no reply')
+                    # A late reply would be mistaken for the answer to the
+                    # next command, so start over with a fresh connection
+                    self.close()
+                return reply
+            except FrameError as e:
+                FRAMES.record(self.name, 'rx', operation, error=str(e))
+                self.close()
+                raise
+            except OSError as e:
+                self.close()
+                if reused and attempt == 0:
+                    logger.info("Stale connection to TV (%s), reconnecting", e)
+                    CONNECTION_FAILURES.inc(self.name, type(e).__name__)
+                    continue
+                raise
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_tv_connection(host=None, port=None, name=None):
+    """Return the process-wide connection for a display, creating it if needed"""
+    key = (host or TV_IP, port or TV_PORT)
+    with _connections_lock:
+        conn = _connections.get(key)
+        if conn is None:
+            conn = TVConnection(*key, name=name)
+            _connections[key] = conn
+            if len(_connections) == 1:
+                threading.Thread(target=_reap_idle_connections, name='tv-conn-reaper', daemon=True).start()
+        return conn
+
+
+def _reap_idle_connections():
+    """Background loop releasing display sockets nobody is using"""
+    while True:
+        time.sleep(max(1.0, min(TV_IDLE_TIMEOUT / 2, 5.0)))
+        with _connections_lock:
+            connections = list(_connections.values())
+        for conn in connections:
+            conn.close_if_idle()
+
+class StateCache:
+    """Last known TV state values with the time each one was read
+
+    A value can be pending: written by a command and not yet confirmed by
+    reading it back from the TV.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self, key):
+        """Return (value, age in seconds), or (None, None) if never read"""
+        with self._lock:
+            entry = self._values.get(key)
+        if entry is None:
+            return None, None
+        value, read_at, _ = entry
+        return value, time.monotonic() - read_at
+
+    def is_pending(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+        return entry is not None and entry[2]
+
+    def set(self, key, value, pending=False, keep_pending=False):
+        """Store a value and return (stored, previous value or None)
+
+        With keep_pending, a pending value is left in place and not replaced.
+        """
+        with self._lock:
+            previous = self._values.get(key)
+            if keep_pending and previous is not None and previous[2]:
+                return False, previous[0]
+            self._values[key] = (value, time.monotonic(), pending)
+        return True, previous[0] if previous is not None else None
+
+    def restore(self, key, value, age):
+        """Store a value read age seconds ago, e.g. before a restart"""
+        with self._lock:
+            self._values[key] = (value, time.monotonic() - age, False)
+
+    def settle(self, key):
+        """Keep a pending value but let reads replace it again"""
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                self._values[key] = (entry[0], entry[1], False)
+
+    def invalidate(self, key):
+        """Force the next read of key to go to the TV
+
+        The value itself is kept so the next read can still tell whether
+        the state changed.
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                self._values[key] = (entry[0], float('-inf'), False)
+
+
+class EventBus:
+    """Fan-out of state change events to any number of subscribers
+
+    Each subscriber gets its own bounded queue; a subscriber that falls
+    behind loses its oldest events rather than blocking the publisher.
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+# State change events from every display, streamed at /events
+EVENTS = EventBus()
+
+
+class StatePoller(threading.Thread):
+    """Background thread refreshing a display's cached state on an interval"""
+
+    def __init__(self, tv, interval):
+        super().__init__(name=f'tv-poller-{tv.display_id}', daemon=True)
+        self.tv = tv
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        logger.info(f"Polling TV at {self.tv.host} every {self.interval}s")
+        with background():
+            while True:
+                if not self._wait_for_quiet():
+                    return
+                try:
+                    self.tv.refresh()
+                except Exception as e:
+                    logger.warning(f"Background refresh of TV at {self.tv.host} failed: {e}")
+                if self._stop_event.wait(self.interval):
+                    return
+
+    def _wait_for_quiet(self):
+        """Put the poll off while user traffic is busy, by one interval at most
+
+        Returns False if the poller was stopped meanwhile.
+        """
+        scheduler = self.tv.connection.scheduler
+        deferred = 0.0
+        while deferred < self.interval:
+            busy = POLL_BACKOFF - scheduler.foreground_idle()
+            if busy <= 0:
+                break
+            delay = min(busy, self.interval - deferred)
+            if self._stop_event.wait(delay):
+                return False
+            deferred += delay
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# Command queue priorities - lower runs first
+PRIORITY_POWER = 0
+PRIORITY_SET = 1
+
+
+class QueuedCommand:
+    """A pending display command that callers can wait on"""
+
+    def __init__(self, key, operation, priority, sequence):
+        self.key = key
+        self.operation = operation
+        self.priority = priority
+        self.sequence = sequence
+        self.collapsed = 0
+        self.result = None
+        self.done = threading.Event()
+        # Wall clock times for job status
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+
+class CommandQueue:
+    """Per-display queue for set commands
+
+    A pending command with the same key as a new one (e.g. two brightness
+    sets while a slider is dragged) is collapsed into the new value, and
+    power commands run before parameter sets. A single worker thread runs
+    the commands, so the display only ever sees the latest requested value.
+    """
+
+    def __init__(self, tv):
+        self.tv = tv
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._sequence = 0
+        self._worker = None
+        self.collapsed = 0
+        self.executed = 0
+
+    def submit(self, key, operation, priority=PRIORITY_SET):
+        """Queue operation(tv) under key and return its QueuedCommand
+
+        If a command with the same key is still waiting, its operation is
+        replaced and existing waiters receive the new command's result.
+        """
+        with self._cond:
+            command = self._pending.get(key)
+            if command is not None:
+                command.operation = operation
+                command.priority = min(command.priority, priority)
+                command.collapsed += 1
+                self.collapsed += 1
+                logger.debug("Collapsed pending %s command for TV at %s", key, self.tv.host)
+            else:
+                self._sequence += 1
+                command = QueuedCommand(key, operation, priority, self._sequence)
+                self._pending[key] = command
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f'tv-queue-{self.tv.display_id}', daemon=True)
+                self._worker.start()
+            self._cond.notify()
+            return command
+
+    def stats(self):
+        with self._cond:
+            return {
+                'depth': len(self._pending),
+                'collapsed': self.collapsed,
+                'executed': self.executed
             }
-            self.wfile.write(json.dumps(response).encode())
-            
-        elif parsed_url.path == '/discovery':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            # Return Home Assistant device discovery info
-            discovery_info = {
-                'devices': [{
-                    'identifiers': [f'nec_tv_{TV_IP}'],
-                    'name': 'NEC TV',
-                    'manufacturer': 'NEC',
-                    'model': 'Network TV',
-                    'sw_version': '1.0.9'
-                }],
-                'entities': [
-                    {
-                        'entity_id': 'switch.nec_tv_power',
-                        'name': 'NEC TV Power',
-                        'type': 'switch',
-                        'device_class': 'switch',
-                        'state_topic': 'nec_tv/state',
-                        'command_topic': 'nec_tv/power/set'
-                    }
-                ]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                command = min(self._pending.values(), key=lambda c: (c.priority, c.sequence))
+                del self._pending[command.key]
+                command.started_at = time.time()
+            try:
+                command.result = command.operation(self.tv)
+            except Exception as e:
+                logger.error(f"Queued {command.key} command for TV at {self.tv.host} failed: {e}")
+                command.result = {'success': False, 'message': str(e)}
+            with self._cond:
+                self.executed += 1
+            command.finished_at = time.time()
+            command.done.set()
+
+
+class JobRegistry:
+    """Queued commands submitted asynchronously, looked up by job id
+
+    Holds at most size jobs. A finished job is dropped ttl seconds after it
+    completed, and the oldest jobs go first when the registry is full, so
+    memory stays bounded however many commands are submitted.
+    """
+
+    def __init__(self, size=JOB_HISTORY_SIZE, ttl=JOB_TTL):
+        self.size = max(1, size)
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, tv, command):
+        """Register a QueuedCommand and return its job id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = (tv.display_id, command)
+            while len(self._jobs) > self.size:
+                self._jobs.popitem(last=False)
+        return job_id
+
+    def get(self, job_id):
+        """Status of a job as a dict, or None if it is unknown or expired"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        display_id, command = job
+        if command.done.is_set():
+            status = 'succeeded' if command.result.get('success') else 'failed'
+        else:
+            status = 'running' if command.started_at is not None else 'queued'
+        return {
+            'id': job_id,
+            'display': display_id,
+            'command': command.key,
+            'status': status,
+            'created_at': command.created_at,
+            'started_at': command.started_at,
+            'finished_at': command.finished_at,
+            'collapsed': command.collapsed,
+            'result': command.result if command.done.is_set() else None,
+        }
+
+    def _prune(self):
+        expired = time.time() - self.ttl
+        for job_id in [job_id for job_id, (_, command) in self._jobs.items()
+                       if command.finished_at is not None and command.finished_at < expired]:
+            del self._jobs[job_id]
+
+
+JOBS = JobRegistry()
+
+
+class NECTV:
+    """Controller for a single NEC display
+
+    Wraps the protocol operations (power, brightness) on top of the shared
+    TVConnection for the display, and keeps the last read values in a cache
+    that a background StatePoller refreshes. A circuit breaker stops
+    requests to a display that can't be reached; reads then report
+    'unavailable' until a background probe gets an answer again.
+    """
+
+    def __init__(self, display_id, host, port, monitor_id=1, poll_interval=POLL_INTERVAL):
+        self.display_id = display_id
+        self.host = host
+        self.port = port
+        self.monitor_id = monitor_id
+        self.connection = get_tv_connection(host, port, name=display_id)
+        self.cache = StateCache()
+        self.queue = CommandQueue(self)
+        # Cached values older than this are read live; with polling disabled
+        # every read goes to the TV
+        self.max_age = 2 * poll_interval
+        self.poller = StatePoller(self, poll_interval) if poll_interval > 0 else None
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, on_change=self._breaker_changed)
+        self._probe_thread = None
+        self._probe_lock = threading.Lock()
+        # Latest write-through per key; confirmations of older ones are skipped
+        self._writes = {}
+        self._writes_lock = threading.Lock()
+        # Parameter name -> {'supported', 'min', 'max'}, None until probed
+        self.capabilities = None
+        self._capabilities_lock = threading.Lock()
+        # Parameters rejected while the display wasn't on, probed again once it is
+        self._unprobed = []
+        # SnapshotStore told about changes worth persisting, if any
+        self.snapshot = None
+        # Keys holding values from the snapshot that no read has replaced yet
+        self._restored = set()
+        # Key -> (last value actually read, wall clock time), kept through outages
+        self._known = {}
+        # Every value stored for these keys, as numbers (see history_value)
+        self.history = {key: HistoryRing(HISTORY_SIZE) for key in POLLED_KEYS}
+        CIRCUIT_STATE.set(BREAKER_STATE_VALUES[CLOSED], display_id)
+        self._readers = {
+            'power': self.get_power_state,
+            'brightness': self.get_brightness,
+        }
+        for name in PARAMETERS:
+            self._readers.setdefault(name, partial(self.read_parameter, name))
+
+    def start(self):
+        """Probe the display's capabilities and start background polling"""
+        threading.Thread(target=self.probe_capabilities, name=f'tv-caps-{self.display_id}', daemon=True).start()
+        if self.poller is not None:
+            self.poller.start()
+
+    @property
+    def available(self):
+        return self.breaker.state == CLOSED
+
+    def refresh(self):
+        """Read the polled values from the TV"""
+        if self.capabilities is None:
+            # The startup probe didn't get through
+            self.probe_capabilities()
+        for key in POLLED_KEYS:
+            self.read(key, fresh=True, source='poll')
+
+    def probe_capabilities(self):
+        """Read every known parameter once to learn its range and whether it is supported
+
+        Runs at startup and whenever the display comes back after being
+        unavailable. Until it succeeds, sets assume the usual 0-100 range.
+        Panels reject parameter reads in standby, so a parameter rejected
+        while the display isn't on is left unknown (and treated as
+        supported) until the display next reports being on.
+        """
+        if not self._capabilities_lock.acquire(blocking=False):
+            return  # already probing
+        try:
+            with background():
+                powered = self.read('power', fresh=True, source='probe')[0] == 'on'
+            capabilities, unknown = {}, []
+            for name, (page, code) in PARAMETERS.items():
+                try:
+                    with background():
+                        info, _ = self.retry(lambda timeout: self.get_parameter(page, code, timeout),
+                                             self._operation_name(page, code, 'get'))
+                except RetryError as e:
+                    if e.error_class != REJECTED:
+                        logger.warning(f"Capability probe of display {self.display_id} failed: {e}")
+                        return
+                    if powered:
+                        capabilities[name] = {'supported': False}
+                    else:
+                        unknown.append(name)
+                    continue
+                capabilities[name] = {'supported': True, 'min': 0, 'max': info['max']}
+                self._update(name, info, 'probe')
+            self.capabilities = capabilities
+            self._unprobed = unknown
+            if self.snapshot is not None:
+                self.snapshot.mark_dirty()
+            unsupported = [name for name, capability in capabilities.items() if not capability['supported']]
+            logger.info(f"Display {self.display_id} capabilities probed, unsupported: {', '.join(unsupported) or 'none'}"
+                        + (f", unknown until powered on: {', '.join(unknown)}" if unknown else ''))
+        finally:
+            self._capabilities_lock.release()
+
+    def supports(self, name):
+        """Whether the display supports a parameter (or power); True until probed"""
+        capability = (self.capabilities or {}).get(name)
+        return capability is None or capability['supported']
+
+    def parameter_max(self, name):
+        """Maximum of a parameter from the capability probe, 100 if not known"""
+        capability = (self.capabilities or {}).get(name)
+        if capability and capability['supported'] and capability['max'] > 0:
+            return capability['max']
+        return 100
+
+    def read(self, key, fresh=False, source='query'):
+        """Return (value, age in seconds) for 'power' or a named parameter
+
+        Served from the cache unless fresh is set or the cached value is
+        missing or too old, in which case the TV is queried. A failed read
+        yields 'unavailable', which is cached too and served until the
+        circuit breaker closes again. A value set by a command is served
+        as is, even with fresh, until its confirmation read. A value
+        restored from the snapshot is served until the first read after
+        startup replaces it, as long as it is no older than max_age or
+        SNAPSHOT_MAX_AGE.
+        """
+        cached = self._cached(key, fresh)
+        if cached is not None:
+            return cached
+        try:
+            value = self._readers[key]()
+        except RetryError as e:
+            logger.warning("Failed to read %s from TV at %s: %s", key, self.host, e)
+            value = UNAVAILABLE
+        self._update(key, value, source)
+        return value, 0.0
+
+    def read_state(self, fresh=False):
+        """Return {key: (value, age)} for power and every supported parameter
+
+        Each value is read like read() does. Cached values are served
+        without touching the connection; whatever has to come from the TV
+        is read back to back in one session.
+        """
+        state = {key: self._cached(key, fresh) for key in self._readers if self.supports(key)}
+        missing = [key for key, cached in state.items() if cached is None]
+        if missing:
+            with self.connection.session():
+                for key in missing:
+                    state[key] = self.read(key, fresh)
+        return state
+
+    def _cached(self, key, fresh):
+        """(value, age) read() would serve from the cache, or None if the TV has to be read"""
+        value, age = self.cache.get(key)
+        if self.cache.is_pending(key):
+            return value, age
+        if not fresh and value is not None:
+            if key in self._restored and age <= max(self.max_age, SNAPSHOT_MAX_AGE):
+                return value, age
+            if age <= self.max_age and (value != UNAVAILABLE or not self.available):
+                return value, age
+        return None
+
+    def is_restored(self, key):
+        """Whether key holds a snapshot value no read has replaced yet"""
+        return key in self._restored
+
+    def _update(self, key, value, source, pending=False):
+        """Store a value and publish an event if it changed
+
+        Only commands and confirmation reads replace a pending value, so a
+        poll that raced with a command can't bring back the old state.
+        """
+        stored, previous = self.cache.set(key, value, pending, keep_pending=source not in ('command', 'confirm'))
+        if stored:
+            self._restored.discard(key)
+            if key in self.history:
+                self.history[key].append(history_value(key, value))
+            if key in self._readers and value != UNAVAILABLE:
+                self._known[key] = (value, time.time())
+            if key == 'power' and value == 'on' and source != 'command' and self._unprobed:
+                # The panel answers parameter reads now; finish the probe
+                self._unprobed = []
+                threading.Thread(target=self.probe_capabilities, name=f'tv-caps-{self.display_id}',
+                                 daemon=True).start()
+        if stored and previous != value:
+            if self.snapshot is not None:
+                self.snapshot.mark_dirty()
+            EVENTS.publish({
+                'display': self.display_id,
+                'key': key,
+                'value': value,
+                'previous': previous,
+                'source': source,
+                'pending': pending,
+                'timestamp': time.time()
+            })
+
+    def _write_through(self, key, value):
+        """Store the value a command set, pending a confirmation read
+
+        The confirmation is scheduled CONFIRM_DELAYS[key] seconds later, so
+        interactive controls see the new value at once without a read-back.
+        """
+        with self._writes_lock:
+            write = self._writes[key] = self._writes.get(key, 0) + 1
+            self._update(key, value, 'command', pending=True)
+        self._schedule_confirm(key, write)
+
+    def _schedule_confirm(self, key, write, again=True):
+        timer = threading.Timer(CONFIRM_DELAYS[key], self._confirm, (key, write, again))
+        timer.daemon = True
+        timer.start()
+
+    def _confirm(self, key, write, again=False):
+        """Read a written value back and replace it with what the TV reports
+
+        A failed read leaves the value the command set in place: it is
+        tried once more if again is set, otherwise the value stops being
+        pending so the next poll can replace it.
+        """
+        with self._writes_lock:
+            if self._writes.get(key) != write:
+                # A newer command wrote this key and will confirm it itself
+                return
+        expected, _ = self.cache.get(key)
+        try:
+            with background():
+                actual = self._readers[key]()
+        except RetryError as e:
+            with self._writes_lock:
+                if self._writes.get(key) != write:
+                    return
+                if again:
+                    logger.warning("Could not confirm %s on TV at %s, trying again: %s", key, self.host, e)
+                    self._schedule_confirm(key, write, again=False)
+                else:
+                    logger.warning("Could not confirm %s on TV at %s, keeping the value set: %s", key, self.host, e)
+                    self.cache.settle(key)
+            return
+        if actual != expected:
+            STATE_DISAGREEMENTS.inc(self.display_id, key)
+            logger.warning("TV at %s reports %s %s, expected %s after the last command", self.host, key, actual, expected)
+        with self._writes_lock:
+            if self._writes.get(key) != write:
+                return
+            self._update(key, actual, 'confirm')
+
+    def snapshot_state(self):
+        """This display's entry in the snapshot file
+
+        State holds the last values actually read, so an outage doesn't
+        erase them from the next warm start.
+        """
+        state = {key: {'value': value, 'read_at': round(read_at, 1)}
+                 for key, (value, read_at) in list(self._known.items())}
+        reply_time = self.connection.reply_time
+        return {
+            'host': self.host,
+            'port': self.port,
+            'state': state,
+            'capabilities': self.capabilities,
+            'reply_time': round(reply_time, 4) if reply_time is not None else None,
+        }
+
+    def restore(self, saved):
+        """Seed the cache, capabilities and reply time from a snapshot entry
+
+        The restored values are served until the first poll confirms or
+        replaces them, for SNAPSHOT_MAX_AGE at most; the capability probe
+        at startup still runs.
+        """
+        if saved.get('host') != self.host or saved.get('port') != self.port:
+            logger.info(f"Display {self.display_id} moved since the last snapshot, starting cold")
+            return
+        now = time.time()
+        for key, entry in (saved.get('state') or {}).items():
+            if key in self._readers:
+                self.cache.restore(key, entry['value'], max(0.0, now - entry['read_at']))
+                self._known[key] = (entry['value'], entry['read_at'])
+                self._restored.add(key)
+        if saved.get('capabilities'):
+            self.capabilities = saved['capabilities']
+        if saved.get('reply_time'):
+            self.connection.reply_time = saved['reply_time']
+        logger.info(f"Display {self.display_id} restored from snapshot: {', '.join(sorted(self._restored)) or 'no state'}")
+
+    def retry(self, operation, name, deadline=None):
+        """Run operation(timeout) under the retry policy for name
+
+        Returns (result, attempts); raises RetryError when giving up, at
+        once with error class 'unavailable' while the circuit breaker is open.
+        The breaker sees the outcome of the whole operation, so retries of
+        one operation count as a single failure.
+        """
+        def attempt(timeout):
+            if not self.available:
+                raise CircuitOpenError(f"Display {self.display_id} is unavailable ({self.breaker.last_error})")
+            return operation(timeout)
+
+        def on_retry(attempt, error_class, error, delay):
+            RETRIES.inc(self.display_id, name)
+            logger.info("%s on TV at %s failed (%s: %s), retrying in %.2fs", name, self.host, error_class, error, delay)
+
+        if not self.available:
+            raise RetryError(f"Display {self.display_id} is unavailable ({self.breaker.last_error})", 0, UNAVAILABLE)
+        try:
+            result, attempts = RETRY_POLICIES[name].run(attempt, deadline, on_retry)
+        except RetryError as e:
+            if e.last_error is not None:
+                self._record_outcome(e.last_error)
+            raise
+        self.breaker.record_success()
+        return result, attempts
+
+    def _record_outcome(self, error):
+        """Feed a failed operation or probe to the circuit breaker"""
+        error_class = classify(error)
+        if error_class in (REJECTED, CORRUPT):
+            # The display answered, so it is reachable
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure(error_class, error)
+
+    def _breaker_changed(self, previous, state):
+        CIRCUIT_STATE.set(BREAKER_STATE_VALUES[state], self.display_id)
+        if state == OPEN and previous == CLOSED:
+            logger.warning(f"Display {self.display_id} at {self.host} is unavailable: {self.breaker.last_error}")
+        elif state == CLOSED:
+            logger.info(f"Display {self.display_id} at {self.host} is available again")
+        if state == OPEN:
+            with self._probe_lock:
+                if self._probe_thread is None:
+                    self._probe_thread = threading.Thread(
+                        target=self._probe, name=f'tv-probe-{self.display_id}', daemon=True)
+                    self._probe_thread.start()
+        if CLOSED in (previous, state):
+            self._update('availability', 'online' if state == CLOSED else 'offline', 'breaker')
+
+    def _probe(self):
+        """Check an unavailable display in the background until it answers
+
+        Meanwhile requests fail fast, so this is the only traffic to the
+        display. Probes back off from BREAKER_PROBE_INTERVAL to
+        BREAKER_PROBE_MAX_INTERVAL.
+        """
+        with background():
+            delay = BREAKER_PROBE_INTERVAL
+            while True:
+                with self._probe_lock:
+                    if self.available:
+                        self._probe_thread = None
+                        break
+                time.sleep(delay)
+                self.breaker.half_open()
+                try:
+                    self.query_power_state(timeout=3)
+                except Exception as e:
+                    self._record_outcome(e)
+                    delay = min(delay * 2, BREAKER_PROBE_MAX_INTERVAL)
+                else:
+                    self.breaker.record_success()
+        self._recovered()
+
+    def _recovered(self):
+        """Catch up with a display that is available again, in the poll lane"""
+        with background():
+            # The display may have been replaced or updated while it was away
+            self.probe_capabilities()
+            # Replace the cached 'unavailable' values right away
+            self.refresh()
+
+    def get_power_state(self):
+        """Query the actual TV power state; raises RetryError"""
+        state, _ = self.retry(self.query_power_state, 'power_query')
+        return state
+
+    def query_power_state(self, timeout=3):
+        """Read the power state once; raises if the TV doesn't answer"""
+        cmd = nec_protocol.power_status_read(self.monitor_id)
+        response = self.connection.exchange(cmd, timeout=timeout, operation='power_query')
+        if not response:
+            raise TimeoutError("No response to power state query")
+        state = nec_protocol.power_state(response)
+        if state == 'unknown':
+            logger.warning("Unknown power state in response: %s", response.raw.hex())
+        else:
+            logger.debug("TV at %s is %s", self.host, state)
+        return state
+
+    def get_brightness(self):
+        """Query the actual TV brightness; raises RetryError"""
+        brightness, _ = self.retry(
+            lambda timeout: self.get_parameter(*PARAMETERS['brightness'], timeout=timeout), 'brightness_get')
+        return brightness
+
+    def read_parameter(self, name):
+        """Query a named parameter under its retry policy; raises RetryError"""
+        page, code = PARAMETERS[name]
+        info, _ = self.retry(lambda timeout: self.get_parameter(page, code, timeout),
+                             self._operation_name(page, code, 'get'))
+        return info
+
+    def get_parameter(self, page, code, timeout=3):
+        """Read a parameter once, returning {'current', 'max'}
+
+        Raises on connection errors, a missing reply or a reply the TV
+        flagged as unsupported.
+        """
+        cmd = nec_protocol.get_parameter(page, code, self.monitor_id)
+        reply = self._parameter_reply(
+            self.connection.exchange(cmd, timeout=timeout, operation=self._operation_name(page, code, 'get')), page, code)
+        logger.debug("Parameter %02X%02X on TV at %s: %s/%s", page, code, self.host, reply.current, reply.max)
+        return {'current': reply.current, 'max': reply.max}
+
+    def set_parameter(self, page, code, value, timeout=3):
+        """Write a parameter once, returning the {'current', 'max'} the TV reports"""
+        cmd = nec_protocol.set_parameter(page, code, value, self.monitor_id)
+        logger.debug("Setting parameter %02X%02X on TV at %s to %s", page, code, self.host, value)
+        reply = self._parameter_reply(
+            self.connection.exchange(cmd, timeout=timeout, operation=self._operation_name(page, code, 'set')), page, code)
+        name = PARAMETER_NAMES.get((page, code))
+        if name is not None:
+            # The reply carries the value the TV applied
+            self._write_through(name, {'current': reply.current, 'max': reply.max})
+        return {'current': reply.current, 'max': reply.max}
+
+    @staticmethod
+    def _operation_name(page, code, kind):
+        """Operation label ('brightness_get', 'parameter_set', ...) for metrics and retry policies"""
+        return ('brightness_' if (page, code) == PARAMETERS['brightness'] else 'parameter_') + kind
+
+    @staticmethod
+    def _parameter_reply(response, page, code):
+        """Decode and check a get/set parameter reply frame"""
+        if not response:
+            raise TimeoutError(f"No reply for parameter {page:02X}{code:02X}")
+        return nec_protocol.expect_parameter(response, page, code)
+
+    def run_batch(self, operations):
+        """Run a list of operations back to back over one connection
+
+        operations are callables taking this NECTV and returning a result
+        dict. The connection is held for the whole batch so other requests
+        can't interleave, and commands are spaced by the scheduler's minimum
+        gap only. The batch waits for its turn in the set lane.
+        """
+        started = time.monotonic()
+        results = []
+        with self.connection.session(LANE_SET):
+            for index, operation in enumerate(operations):
+                try:
+                    results.append(operation(self))
+                except Exception as e:
+                    logger.warning("Batch operation %s on TV at %s failed: %s", index, self.host, e)
+                    results.append({'success': False, 'error': str(e)})
+        return {
+            'success': all(result.get('success') for result in results),
+            'results': results,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        }
+
+    def power_result(self, action, deadline=None):
+        """Send a power command and describe the outcome for API responses"""
+        try:
+            attempts = self.send_command(action, deadline)
+        except RetryError as e:
+            logger.error("Failed to send %s command to TV at %s: %s", action, self.host, e)
+            return {
+                'success': False,
+                'action': action,
+                'message': 'Failed to send command',
+                'error': e.error_class,
+                'attempts': e.attempts
             }
-            self.wfile.write(json.dumps(discovery_info).encode())
-            
-        elif parsed_url.path == '/homeassistant':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            
-            # Return HTML page with YAML configuration
-            yaml_config = f"""# NEC TV Control Integration
+        return {
+            'success': True,
+            'action': action,
+            'message': f'TV power {action} command sent',
+            'attempts': attempts
+        }
+
+    def brightness_result(self, brightness, deadline=None):
+        """Set the brightness and describe the outcome for API responses"""
+        try:
+            attempts = self.set_brightness(brightness, deadline)
+        except RetryError as e:
+            logger.error("Failed to set brightness on TV at %s: %s", self.host, e)
+            return {
+                'success': False,
+                'brightness': brightness,
+                'message': 'Failed to set brightness',
+                'error': e.error_class,
+                'attempts': e.attempts
+            }
+        return {
+            'success': True,
+            'brightness': brightness,
+            'message': f'TV brightness set to {brightness}%',
+            'attempts': attempts
+        }
+
+    def parameter_result(self, page, code, value=None, deadline=None):
+        """Read (or with value, write) a parameter and describe the outcome
+
+        Parameters the capability probe found unsupported, and values above
+        a parameter's maximum, are refused without contacting the display.
+        """
+        capability = (self.capabilities or {}).get(PARAMETER_NAMES.get((page, code)))
+        if capability is not None and not capability['supported']:
+            return {'success': False, 'error': REJECTED, 'attempts': 0,
+                    'message': f'Parameter {page:02X}{code:02X} is not supported by this display'}
+        if capability is not None and value is not None and value > capability['max']:
+            return {'success': False, 'error': REJECTED, 'attempts': 0,
+                    'message': f'Value {value} exceeds the maximum {capability["max"]}'}
+        if value is None:
+            operation = lambda timeout: self.get_parameter(page, code, timeout)
+        else:
+            operation = lambda timeout: self.set_parameter(page, code, value, timeout)
+        try:
+            result, attempts = self.retry(operation, self._operation_name(page, code, 'get' if value is None else 'set'), deadline)
+        except RetryError as e:
+            return {'success': False, 'error': e.error_class, 'message': str(e), 'attempts': e.attempts}
+        return dict(result, success=True, attempts=attempts)
+
+    def queue_power(self, action, deadline=None):
+        """Queue a power command ahead of parameter sets"""
+        return self.queue.submit('power', lambda tv: tv.power_result(action, deadline), PRIORITY_POWER)
+
+    def queue_brightness(self, brightness, deadline=None):
+        """Queue a brightness set, collapsing it with any pending one"""
+        return self.queue.submit('brightness', lambda tv: tv.brightness_result(brightness, deadline), PRIORITY_SET)
+
+    def set_brightness(self, percentage, deadline=None):
+        """Set TV brightness (0-100%) under the brightness_set retry policy
+
+        Returns the number of attempts used; raises RetryError.
+        """
+        # Scale against the range found by the capability probe, no read needed
+        brightness_value = round(percentage * self.parameter_max('brightness') / 100)
+        logger.debug("Setting TV brightness to %s%% (value %s)", percentage, brightness_value)
+        _, attempts = self.retry(
+            lambda timeout: self.set_parameter(*PARAMETERS['brightness'], brightness_value, timeout),
+            'brightness_set', deadline)
+        logger.info("Set brightness on TV at %s to %s%%", self.host, percentage)
+        return attempts
+
+    def send_command(self, action, deadline=None):
+        """Send a power command under the power_set retry policy
+
+        Returns the number of attempts used; raises RetryError.
+        """
+        _, attempts = self.retry(lambda timeout: self.power_control(action, timeout), 'power_set', deadline)
+        logger.info("Sent %s command to TV at %s:%s", action, self.host, self.port)
+        return attempts
+
+    def power_control(self, action, timeout=5):
+        """Send the power command once and wait for the TV to confirm it"""
+        command = nec_protocol.power_control(action, self.monitor_id)
+        response = self.connection.exchange(command, timeout=timeout, operation='power_set')
+        if not response:
+            # The command may still have been applied
+            self.cache.invalidate('power')
+            raise TimeoutError(f"No response to power {action} command")
+        if not response.ok:
+            raise nec_protocol.ProtocolError(f"TV rejected power {action} (result {response.result:02X})")
+        # The reply echoes the power mode the TV is switching to
+        self._write_through('power', nec_protocol.POWER_MODES.get(response.current, 'unknown'))
+
+
+class DisplayFleet:
+    """The set of configured displays, addressable by id"""
+
+    def __init__(self, displays):
+        self._displays = {tv.display_id: tv for tv in displays}
+        self.default = displays[0]
+        # One worker per display so a fan-out costs about one display's latency
+        self._executor = ThreadPoolExecutor(max_workers=max(len(displays), 1), thread_name_prefix='tv-fanout')
+
+    def __iter__(self):
+        return iter(self._displays.values())
+
+    def __len__(self):
+        return len(self._displays)
+
+    def get(self, display_id):
+        return self._displays.get(display_id)
+
+    def start(self):
+        for tv in self:
+            tv.start()
+
+    def restore(self, snapshot):
+        """Warm up the displays from a SnapshotStore and report changes to it"""
+        saved = snapshot.load()
+        for tv in self:
+            if tv.display_id in saved:
+                try:
+                    tv.restore(saved[tv.display_id])
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Ignoring malformed snapshot of display {tv.display_id}: {e}")
+            tv.snapshot = snapshot
+
+    def snapshot_state(self):
+        return {tv.display_id: tv.snapshot_state() for tv in self}
+
+    def device_info(self, tv):
+        """Home Assistant device description for a display"""
+        return {
+            'identifiers': [f'nec_tv_{tv.host}'],
+            'name': 'NEC TV' if len(self) == 1 else f'NEC TV {tv.display_id}',
+            'manufacturer': 'NEC',
+            'model': 'Network TV',
+            'sw_version': '1.0.9'
+        }
+
+    def describe(self):
+        return [{'id': tv.display_id, 'ip': tv.host, 'port': tv.port, 'monitor_id': tv.monitor_id} for tv in self]
+
+    def fan_out(self, displays, operation):
+        """Run operation(tv) on the displays in parallel
+
+        Returns per-display results and the total wall time.
+        """
+        started = time.monotonic()
+        futures = {tv.display_id: self._executor.submit(operation, tv) for tv in displays}
+        results = {}
+        for display_id, future in futures.items():
+            try:
+                results[display_id] = future.result()
+            except Exception as e:
+                logger.error(f"Group operation failed on display {display_id}: {e}")
+                results[display_id] = {'success': False, 'message': str(e)}
+        return {
+            'success': all(result.get('success') for result in results.values()),
+            'results': results,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        }
+
+
+def brightness_percentage(brightness_info):
+    """Brightness as a 0-100 percentage of the display's maximum"""
+    if brightness_info['max'] > 0:
+        return round((brightness_info['current'] / brightness_info['max']) * 100)
+    return 0
+
+
+def history_value(key, value):
+    """Number recorded in the history: power 1 (on) or 0, brightness in percent, NaN if unknown"""
+    if value == UNAVAILABLE or value is None:
+        return math.nan
+    if key == 'power':
+        return 1.0 if value == 'on' else math.nan if value == 'unknown' else 0.0
+    return float(brightness_percentage(value))
+
+
+class MQTTBridge:
+    """Publishes display state to MQTT and runs commands received over MQTT
+
+    Topics per display, under the configured prefix:
+      <prefix>/<id>/power/state       ON/OFF (retained)
+      <prefix>/<id>/power/set         ON/OFF commands
+      <prefix>/<id>/brightness/state  0-100 (retained)
+      <prefix>/<id>/brightness/set    0-100 commands
+      <prefix>/<id>/availability      online/offline (retained)
+    plus <prefix>/availability (online/offline, the client's last will).
+    Home Assistant discovery configs are published on the first connect and
+    again whenever Home Assistant announces itself on <discovery>/status.
+    """
+
+    def __init__(self, fleet, host, port=1883, username=None, password=None):
+        self.fleet = fleet
+        self.availability_topic = f'{MQTT_TOPIC_PREFIX}/availability'
+        self.client = MQTTClient(
+            host, port,
+            client_id='nec_tv_control',
+            username=username or None,
+            password=password or None,
+            will=(self.availability_topic, 'offline', True),
+            on_connect=self._on_connect,
+            on_message=self._on_message,
+        )
+        self._discovery_sent = False
+
+    @staticmethod
+    def topic(tv, suffix):
+        return f'{MQTT_TOPIC_PREFIX}/{tv.display_id}/{suffix}'
+
+    def start(self):
+        for tv in self.fleet:
+            self.client.subscribe(self.topic(tv, 'power/set'))
+            self.client.subscribe(self.topic(tv, 'brightness/set'))
+        self.client.subscribe(f'{MQTT_DISCOVERY_PREFIX}/status')
+        self.client.start()
+        threading.Thread(target=self._publish_events, name='mqtt-events', daemon=True).start()
+
+    def _on_connect(self):
+        self.client.publish(self.availability_topic, 'online', retain=True)
+        if not self._discovery_sent:
+            self._publish_discovery()
+        # Retained state so subscribers see the current values right away
+        for tv in self.fleet:
+            self._publish_state(tv, 'availability', 'online' if tv.available else 'offline')
+            for key in ('power', 'brightness'):
+                value, _ = tv.cache.get(key)
+                if value is not None:
+                    self._publish_state(tv, key, value)
+
+    def _publish_discovery(self):
+        for tv in self.fleet:
+            device = self.fleet.device_info(tv)
+            common = {
+                'availability': [
+                    {'topic': self.availability_topic},
+                    {'topic': self.topic(tv, 'availability')},
+                ],
+                'availability_mode': 'all',
+                'device': device,
+            }
+            self.client.publish(
+                f'{MQTT_DISCOVERY_PREFIX}/switch/nec_tv_{tv.display_id}/power/config',
+                json.dumps(dict(common,
+                    name=f'{device["name"]} Power',
+                    unique_id=f'nec_tv_{tv.display_id}_power',
+                    state_topic=self.topic(tv, 'power/state'),
+                    command_topic=self.topic(tv, 'power/set'),
+                    payload_on='ON',
+                    payload_off='OFF',
+                    icon='mdi:television')),
+                retain=True)
+            self.client.publish(
+                f'{MQTT_DISCOVERY_PREFIX}/number/nec_tv_{tv.display_id}/brightness/config',
+                json.dumps(dict(common,
+                    name=f'{device["name"]} Brightness',
+                    unique_id=f'nec_tv_{tv.display_id}_brightness',
+                    state_topic=self.topic(tv, 'brightness/state'),
+                    command_topic=self.topic(tv, 'brightness/set'),
+                    min=0,
+                    max=100,
+                    step=1,
+                    unit_of_measurement='%',
+                    icon='mdi:brightness-6')),
+                retain=True)
+        self._discovery_sent = True
+        logger.info("Published Home Assistant MQTT discovery")
+
+    def _publish_state(self, tv, key, value):
+        if key == 'availability':
+            self.client.publish(self.topic(tv, 'availability'), value, retain=True)
+            return
+        if value == UNAVAILABLE:
+            # The availability topic already tells Home Assistant
+            return
+        if key == 'power':
+            payload = 'ON' if value == 'on' else 'OFF'
+        elif key == 'brightness':
+            payload = str(brightness_percentage(value))
+        else:
+            # Other parameters have no MQTT entities
+            return
+        self.client.publish(self.topic(tv, f'{key}/state'), payload, retain=True)
+
+    def _publish_events(self):
+        """Forward state change events to MQTT"""
+        subscriber = EVENTS.subscribe()
+        while True:
+            event = subscriber.get()
+            tv = self.fleet.get(event['display'])
+            if tv is not None:
+                self._publish_state(tv, event['key'], event['value'])
+
+    def _on_message(self, topic, payload):
+        payload = payload.decode('utf-8', 'replace').strip()
+        if topic == f'{MQTT_DISCOVERY_PREFIX}/status':
+            # Home Assistant restarted - it needs the discovery configs again
+            if payload == 'online':
+                self._publish_discovery()
+            return
+        prefix = f'{MQTT_TOPIC_PREFIX}/'
+        if not topic.startswith(prefix):
+            return
+        display_id, _, command = topic[len(prefix):].partition('/')
+        tv = self.fleet.get(display_id)
+        if tv is None:
+            return
+        if command == 'power/set' and payload.upper() in ('ON', 'OFF'):
+            tv.queue_power(payload.lower())
+        elif command == 'brightness/set':
+            try:
+                brightness = float(payload)
+            except ValueError:
+                brightness = None
+            if NECTVHandler._valid_brightness(brightness):
+                tv.queue_brightness(brightness)
+            else:
+                logger.warning(f"Ignoring invalid brightness {payload!r} on {topic}")
+        else:
+            logger.warning(f"Ignoring MQTT command {payload!r} on {topic}")
+
+
+def homeassistant_page():
+    """HTML page with the YAML configuration for a REST switch"""
+    yaml_config = f"""# NEC TV Control Integration
 switch:
   - platform: rest
     name: "NEC TV Power"
@@ -89,8 +1566,8 @@ switch:
       Content-Type: application/json
     # Note: TV state cannot be queried via network, so we use a default template
     is_on_template: "false"  # Always shows as off, but commands still work"""
-            
-            html_content = f"""<!DOCTYPE html>
+    
+    return f"""<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -233,443 +1710,656 @@ switch:
 </body>
 </html>"""
             
-            self.wfile.write(html_content.encode())
-            
-        elif parsed_url.path == '/power':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            # Query the actual TV power state
-            tv_state = self.get_tv_power_state()
-            response = {
-                'state': tv_state,
-                'is_on': tv_state == 'on',
-                'message': f'TV is currently {tv_state}'
-            }
-            self.wfile.write(json.dumps(response).encode())
-            
-        elif parsed_url.path == '/brightness':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            # Query the actual TV brightness
-            brightness_info = self.get_tv_brightness()
-            response = {
-                'brightness': brightness_info['current'],
-                'max_brightness': brightness_info['max'],
-                'percentage': round((brightness_info['current'] / brightness_info['max']) * 100) if brightness_info['max'] > 0 else 0,
-                'message': f'TV brightness: {brightness_info["current"]}/{brightness_info["max"]} ({round((brightness_info["current"] / brightness_info["max"]) * 100) if brightness_info["max"] > 0 else 0}%)'
-            }
-            self.wfile.write(json.dumps(response).encode())
-            
-        elif parsed_url.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            response = {
-                'status': 'healthy',
-                'service': 'NEC TV Control',
-                'version': '1.0.14'
-            }
-            self.wfile.write(json.dumps(response).encode())
-            
-        else:
-            self.send_response(404)
-            self.end_headers()
+
+
+class StaticResponse:
+    """Response body rendered once, with its ETag and gzip-compressed form
+
+    Serving one costs a dictionary lookup and a write: no JSON encoding or
+    templating per request, and clients revalidating with If-None-Match get
+    an empty 304.
+    """
+
+    # Bodies this small don't gain anything from compression
+    MIN_GZIP_SIZE = 256
+
+    def __init__(self, body, content_type):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body = body
+        self.content_type = content_type
+        self.etag = f'"{digest}"'
+        self.gzipped = None
+        self.gzip_etag = None
+        if len(body) >= self.MIN_GZIP_SIZE:
+            # mtime=0 keeps the compressed bytes, and so the ETag, stable
+            self.gzipped = gzip.compress(body, mtime=0)
+            self.gzip_etag = f'"{digest}-gzip"'
+
+    def matches(self, if_none_match):
+        """Whether an If-None-Match header names one of our representations"""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in tags:
+            return True
+        # If-None-Match uses the weak comparison
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        return self.etag in tags or (self.gzip_etag is not None and self.gzip_etag in tags)
+
+
+def render_static_responses(fleet):
+    """Prerender the responses that only depend on the configuration
+
+    Returns {route: StaticResponse}. Call it again whenever the displays
+    change; the add-on restarts on option changes, so main() builds them once.
+    """
+    info = {
+        'name': 'NEC TV Control',
+        'version': '1.0.9',
+        'tv_ip': fleet.default.host,
+        'tv_port': fleet.default.port,
+        'displays': fleet.describe()
+    }
+    # Home Assistant device discovery info
+    discovery_info = {
+        'devices': [fleet.device_info(display) for display in fleet],
+        'entities': [
+            {
+                'entity_id': 'switch.nec_tv_power' if len(fleet) == 1 else f'switch.nec_tv_{display.display_id}_power',
+                'name': f'{fleet.device_info(display)["name"]} Power',
+                'type': 'switch',
+                'device_class': 'switch',
+                'state_topic': MQTTBridge.topic(display, 'power/state'),
+                'command_topic': MQTTBridge.topic(display, 'power/set')
+            } for display in fleet
+        ]
+    }
+    return {
+        '/': StaticResponse(json.dumps(info), 'application/json'),
+        '/discovery': StaticResponse(json.dumps(discovery_info), 'application/json'),
+        '/homeassistant': StaticResponse(homeassistant_page(), 'text/html; charset=utf-8'),
+    }
+
+
+class NECTVHandler(BaseHTTPRequestHandler):
+    """HTTP request handler for NEC TV control
+
+    Requests are handled concurrently; anything that talks to the TV goes
+    through get_tv_connection(), which serializes access per display.
+    Connections are persistent (HTTP/1.1), so every response carries a
+    Content-Length and request bodies are always read in full.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are dropped after this many seconds
+    timeout = HTTP_IDLE_TIMEOUT
+    # Headers and body go out in separate writes; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    # DisplayFleet with the configured displays, set up in main()
+    fleet = None
+    # Client connections currently open, across all handler threads
+    open_connections = 0
+    _connections_lock = threading.Lock()
+    # Prerendered responses by route, from render_static_responses()
+    static = {}
+    
+    # (method, route) -> (handler method, served under /displays/<id>/ too).
+    # Handlers get the addressed NECTV, and POST handlers the JSON body.
+    ROUTES = {
+        ('GET', '/health'): ('_get_health', False),
+        ('GET', '/displays'): ('_get_displays', False),
+        ('GET', '/metrics'): ('_get_metrics', False),
+        ('GET', '/power'): ('_get_power', True),
+        ('GET', '/brightness'): ('_get_brightness', True),
+        ('GET', '/queue'): ('_get_queue', True),
+        ('GET', '/events'): ('_get_events', True),
+        ('GET', '/capabilities'): ('_get_capabilities', True),
+        ('GET', '/state'): ('_get_state', True),
+        ('GET', '/history'): ('_get_history', True),
+        ('GET', '/debug/frames'): ('_get_debug_frames', True),
+        ('GET', '/jobs/{id}'): ('_get_job', False),
+        ('POST', '/power'): ('_post_power', True),
+        ('POST', '/brightness'): ('_post_brightness', True),
+        ('POST', '/batch'): ('_post_batch', True),
+        ('POST', '/group/power'): ('_post_group_power', False),
+        ('POST', '/group/brightness'): ('_post_group_brightness', False),
+    }
+    
+    def setup(self):
+        super().setup()
+        with NECTVHandler._connections_lock:
+            NECTVHandler.open_connections += 1
+    
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            with NECTVHandler._connections_lock:
+                NECTVHandler.open_connections -= 1
+    
+    def do_GET(self):
+        self._observe('GET')
     
     def do_POST(self):
-        """Handle POST requests for TV control"""
+        self._observe('POST')
+    
+    def _observe(self, method):
+        """Handle a request and record HTTP metrics for it"""
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        self._status = 500
+        try:
+            self._dispatch(method)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = self._route_label()
+            HTTP_REQUESTS.inc(method, route, str(self._status))
+            HTTP_DURATION.observe(time.perf_counter() - started, method, route)
+    
+    def _route_label(self):
+        """Route for metric labels, without display ids or unknown paths"""
+        if self._status == 404:
+            return 'other'
+        path = urlparse(self.path).path
+        if path.startswith('/displays/'):
+            _, _, rest = path[len('/displays/'):].partition('/')
+            return '/displays/{id}/' + rest
+        if path.startswith('/jobs/'):
+            return '/jobs/{id}'
+        return path
+    
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+        # Announce when the connection ends after this response, including
+        # when too many are open and this one shouldn't be kept alive
+        if self.close_connection or NECTVHandler.open_connections > HTTP_MAX_KEEPALIVE:
+            self.send_header('Connection', 'close')
+    
+    def _dispatch(self, method):
+        """Look the request up in the static responses and ROUTES and run its handler"""
         parsed_url = urlparse(self.path)
+        if method == 'GET' and parsed_url.path in self.static:
+            self._send_static(self.static[parsed_url.path])
+            return
         
-        if parsed_url.path == '/power':
-            if 'Content-Length' not in self.headers:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Content-Length header required'}).encode())
-                return
-                
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            try:
-                data = json.loads(post_data.decode('utf-8'))
-                action = data.get('action')
-                
-                if action in ['on', 'off']:
-                    success = self.send_tv_command(action)
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    
-                    response = {
-                        'success': success,
-                        'action': action,
-                        'message': f'TV power {action} command sent' if success else 'Failed to send command'
-                    }
-                    self.wfile.write(json.dumps(response).encode())
-                else:
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'error': 'Invalid action'}).encode())
-                    
-            except json.JSONDecodeError:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
-                
-        elif parsed_url.path == '/brightness':
-            if 'Content-Length' not in self.headers:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Content-Length header required'}).encode())
-                return
-                
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            try:
-                data = json.loads(post_data.decode('utf-8'))
-                brightness = data.get('brightness')
-                
-                if brightness is not None and isinstance(brightness, (int, float)) and 0 <= brightness <= 100:
-                    success = self.set_tv_brightness(int(brightness))
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    
-                    response = {
-                        'success': success,
-                        'brightness': brightness,
-                        'message': f'TV brightness set to {brightness}%' if success else 'Failed to set brightness'
-                    }
-                    self.wfile.write(json.dumps(response).encode())
-                else:
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'error': 'Invalid brightness value (must be 0-100)'}).encode())
-                    
-            except json.JSONDecodeError:
-                self.send_response(400)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
+        self._params = parse_qs(parsed_url.query)
+        self._display_scoped = parsed_url.path.startswith('/displays/')
+        tv, route = self._resolve_display(parsed_url.path)
+        if route is not None and route.startswith('/jobs/'):
+            route, self._job_id = '/jobs/{id}', route[len('/jobs/'):]
+        name, per_display = self.ROUTES.get((method, route), (None, False))
+        if tv is None or name is None or (self._display_scoped and not per_display):
+            if 'Content-Length' in self.headers or 'Transfer-Encoding' in self.headers:
+                # The unread body would be parsed as the next request
+                self.close_connection = True
+            self._send_json(404, {'error': 'Not found'})
+            return
+        
+        handler = getattr(self, name)
+        if method == 'POST':
+            data = self._read_json()
+            if data is not None:
+                handler(tv, data)
         else:
-            self.send_response(404)
-            self.end_headers()
+            handler(tv)
     
-    def get_tv_power_state(self):
-        """Query the actual TV power state"""
+    def _flag(self, name, default):
+        """Boolean query parameter such as ?fresh=1 or ?wait=0"""
+        value = self._params.get(name, [''])[0].lower()
+        if value in ('1', 'true', 'yes'):
+            return True
+        if value in ('0', 'false', 'no'):
+            return False
+        return default
+    
+    def _deadline(self):
+        """Absolute deadline from ?timeout=<seconds>, or None for the retry policy's own"""
         try:
-            # Power status query command: SOH-'0'-'A'-'0'-'A'-'0'-'6'-STX-'0'-'1'-'D'-'6'-ETX-BCC-CR
-            cmd = bytearray([0x01, 0x30, 0x41, 0x30, 0x41, 0x30, 0x36, 0x02, 0x30, 0x31, 0x44, 0x36, 0x03])
-            
-            # Calculate BCC (XOR of all bytes except SOH)
-            bcc = 0
-            for byte in cmd[1:]:
-                bcc ^= byte
-            cmd.append(bcc)
-            cmd.append(0x0D)
-            
-            logger.info(f"Querying TV power state: {cmd.hex()}")
-            
-            # Create socket connection
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(3)  # Shorter timeout for state queries
-            
-            # Connect to TV
-            sock.connect((TV_IP, TV_PORT))
-            
-            # Send query
-            sock.send(cmd)
-            
-            # Wait for response
-            import time
-            time.sleep(0.5)
-            response = sock.recv(1024)
-            sock.close()
-            
-            if response:
-                logger.info(f"Power state response: {response.hex()}")
-                
-                # Parse the response for power mode
-                if b'0001' in response:
-                    logger.info("TV state: ON")
-                    return 'on'
-                elif b'0004' in response:
-                    logger.info("TV state: OFF")
-                    return 'off'
-                elif b'0002' in response:
-                    logger.info("TV state: STANDBY")
-                    return 'standby'
-                else:
-                    logger.warning(f"Unknown power state in response: {response.hex()}")
-                    return 'unknown'
-            else:
-                logger.warning("No response to power state query")
-                return 'unknown'
-                
-        except Exception as e:
-            logger.warning(f"Failed to query TV power state: {e}")
-            # If we can't query the state, assume it's off (conservative approach)
-            return 'off'
+            return time.monotonic() + max(float(self._params['timeout'][0]), 0)
+        except (KeyError, ValueError):
+            return None
+    
+    def _get_health(self, tv):
+        # The service itself is healthy either way; unreachable displays only degrade it
+        displays = {display.display_id: self._display_health(display) for display in self.fleet}
+        self._send_json(200, {
+            'status': 'healthy' if all(display.available for display in self.fleet) else 'degraded',
+            'service': 'NEC TV Control',
+            'version': '1.0.14',
+            'displays': displays
+        })
+    
+    @staticmethod
+    def _display_health(tv):
+        health = tv.breaker.as_dict()
+        reply_time = tv.connection.reply_time
+        health['reply_ms'] = round(reply_time * 1000, 1) if reply_time is not None else None
+        return health
 
-    def get_tv_brightness(self):
-        """Query the actual TV brightness"""
+    def _get_displays(self, tv):
+        self._send_json(200, {'displays': self.fleet.describe()})
+    
+    def _get_metrics(self, tv):
+        self._send_body(200, 'text/plain; version=0.0.4', REGISTRY.render().encode())
+    
+    def _get_queue(self, tv):
+        self._send_json(200, dict(tv.queue.stats(), scheduler=tv.connection.scheduler.stats()))
+    
+    def _get_capabilities(self, tv):
+        self._send_json(200, {
+            'display': tv.display_id,
+            'probed': tv.capabilities is not None,
+            'parameters': tv.capabilities or {}
+        })
+    
+    def _get_debug_frames(self, tv):
+        # /debug/frames traces every display, /displays/<id>/debug/frames just one
         try:
-            # Brightness query command: SOH-'0'-'A'-'0'-'C'-'0'-'6'-STX-'0'-'0'-'1'-'0'-ETX-BCC-CR
-            cmd = bytearray([0x01, 0x30, 0x41, 0x30, 0x43, 0x30, 0x36, 0x02, 0x30, 0x30, 0x31, 0x30, 0x03])
-            
-            # Calculate BCC (XOR of all bytes except SOH)
-            bcc = 0
-            for byte in cmd[1:]:
-                bcc ^= byte
-            cmd.append(bcc)
-            cmd.append(0x0D)
-            
-            logger.info(f"Querying TV brightness: {cmd.hex()}")
-            
-            # Create socket connection
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(3)
-            
-            # Connect to TV
-            sock.connect((TV_IP, TV_PORT))
-            
-            # Send query
-            sock.send(cmd)
+            limit = int(self._params['limit'][0])
+        except (KeyError, ValueError):
+            limit = None
+        self._send_json(200, {'frames': FRAMES.entries(tv.display_id if self._display_scoped else None, limit)})
+    
+    def _get_job(self, tv):
+        job = JOBS.get(self._job_id)
+        if job is None:
+            self._send_json(404, {'error': 'Unknown or expired job'})
+        else:
+            self._send_json(200, job)
+    
+    def _get_events(self, tv):
+        # /events streams every display, /displays/<id>/events just one
+        self._stream_events(tv.display_id if self._display_scoped else None)
+    
+    def _get_power(self, tv):
+        # Served from the poller's cache; ?fresh=1 forces a live query
+        tv_state, age = tv.read('power', fresh=self._flag('fresh', False))
+        self._send_json(200, {
+            'state': tv_state,
+            'is_on': tv_state == 'on',
+            'available': tv_state != UNAVAILABLE,
+            'message': f'TV is currently {tv_state}',
+            'cached': age > 0,
+            'age_seconds': round(age, 3),
+            'pending': tv.cache.is_pending('power'),
+            'restored': tv.is_restored('power')
+        })
+    
+    def _get_brightness(self, tv):
+        # Served from the poller's cache; ?fresh=1 forces a live query
+        brightness_info, age = tv.read('brightness', fresh=self._flag('fresh', False))
+        if brightness_info == UNAVAILABLE:
+            self._send_json(503, {
+                'error': UNAVAILABLE,
+                'message': 'TV brightness is unavailable',
+                'cached': age > 0,
+                'age_seconds': round(age, 3)
+            })
+            return
+        self._send_json(200, {
+            'brightness': brightness_info['current'],
+            'max_brightness': brightness_info['max'],
+            'percentage': brightness_percentage(brightness_info),
+            'message': f'TV brightness: {brightness_info["current"]}/{brightness_info["max"]} ({brightness_percentage(brightness_info)}%)',
+            'cached': age > 0,
+            'age_seconds': round(age, 3),
+            'pending': tv.cache.is_pending('brightness'),
+            'restored': tv.is_restored('brightness')
+        })
+    
+    def _get_state(self, tv):
+        # Power, brightness and the other parameters for a single REST resource
+        started = time.monotonic()
+        state = tv.read_state(fresh=self._flag('fresh', False))
+        power, _ = state['power']
+        brightness_info, _ = state.get('brightness', (UNAVAILABLE, 0))
+        has_brightness = brightness_info != UNAVAILABLE
+        self._send_json(200, {
+            'display': tv.display_id,
+            'available': power != UNAVAILABLE,
+            'power': power,
+            'is_on': power == 'on',
+            'brightness': brightness_info['current'] if has_brightness else None,
+            'max_brightness': brightness_info['max'] if has_brightness else None,
+            'percentage': brightness_percentage(brightness_info) if has_brightness else None,
+            'parameters': {
+                key: value if value != UNAVAILABLE else None
+                for key, (value, _) in state.items() if key != 'power'
+            },
+            'age_seconds': {key: round(age, 3) for key, (_, age) in state.items()},
+            'restored': [key for key in state if tv.is_restored(key)],
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        })
+    
+    def _get_history(self, tv):
+        # ?since= and ?until= are Unix timestamps, ?step= the bucket width in seconds
+        now = time.time()
+        try:
+            until = float(self._params.get('until', [now])[0])
+            since = float(self._params.get('since', [until - 86400])[0])
+            step = float(self._params.get('step', [300])[0])
+        except ValueError:
+            self._send_json(400, {'error': 'since, until and step must be numbers'})
+            return
+        if not (since < until and step > 0) or (until - since) / step > HISTORY_MAX_BUCKETS:
+            self._send_json(400, {'error': f'Need since < until and at most {HISTORY_MAX_BUCKETS} buckets of step seconds'})
+            return
+        # A sample stands for the time until the next one; polls may be put
+        # off by one interval, so allow for that and some slack
+        max_gap = max(3 * (tv.poller.interval if tv.poller is not None else 0), 60)
+        body = {'display': tv.display_id, 'since': since, 'until': until, 'step': step, 'totals': {}}
+        for key, ring in tv.history.items():
+            times, values = ring.samples(since)
+            buckets = downsample(times, values, since, until, step, max_gap)
+            total, = downsample(times, values, since, until, until - since, max_gap)
+            body[key] = [self._history_bucket(bucket) for bucket in buckets]
+            body['totals'][key] = {
+                'samples': total['samples'],
+                'known_seconds': total['known_seconds'],
+                'avg': round(total['avg'], 3) if total['avg'] is not None else None,
+            }
+        power = body['totals']['power']
+        power['on_seconds'] = round(power['avg'] * power['known_seconds'], 1) if power['avg'] is not None else 0.0
+        self._send_json(200, body)
+    
+    @staticmethod
+    def _history_bucket(bucket):
+        return {name: round(value, 3) if isinstance(value, float) and name != 'start' else value
+                for name, value in bucket.items()}
+    
+    def _post_power(self, tv, data):
+        # ?async=1 (or ?wait=0) queues the command and returns a job without waiting for the TV
+        action = data.get('action')
+        if action in ['on', 'off']:
+            self._send_queued(tv.queue_power(action, self._deadline()), tv)
+        else:
+            self._send_json(400, {'error': 'Invalid action'})
+    
+    def _post_brightness(self, tv, data):
+        brightness = data.get('brightness')
+        if self._valid_brightness(brightness):
+            self._send_queued(tv.queue_brightness(brightness, self._deadline()), tv)
+        else:
+            self._send_json(400, {'error': 'Invalid brightness value (must be 0-100)'})
+    
+    def _post_batch(self, tv, data):
+        try:
+            operations = [self._batch_operation(op) for op in data.get('operations') or []]
+        except (TypeError, ValueError, KeyError) as e:
+            self._send_json(400, {'error': f'Invalid operation: {e}'})
+            return
+        if not operations:
+            self._send_json(400, {'error': 'operations must be a non-empty list'})
+            return
+        self._send_json(200, tv.run_batch(operations))
+    
+    def _post_group_power(self, tv, data):
+        action = data.get('action')
+        displays = self._group_displays(data)
+        if displays is None:
+            return
+        if action in ['on', 'off']:
+            deadline = self._deadline()
+            self._send_json(200, self.fleet.fan_out(displays, lambda tv: self._queued_result(tv.queue_power(action, deadline), tv)))
+        else:
+            self._send_json(400, {'error': 'Invalid action'})
+    
+    def _post_group_brightness(self, tv, data):
+        brightness = data.get('brightness')
+        displays = self._group_displays(data)
+        if displays is None:
+            return
+        if self._valid_brightness(brightness):
+            deadline = self._deadline()
+            self._send_json(200, self.fleet.fan_out(displays, lambda tv: self._queued_result(tv.queue_brightness(brightness, deadline), tv)))
+        else:
+            self._send_json(400, {'error': 'Invalid brightness value (must be 0-100)'})
+    
+    def _send_static(self, response):
+        """Send a prerendered response, or 304 if the client's copy is current"""
+        gzipped = response.gzipped is not None and 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = response.gzip_etag if gzipped else response.etag
+        if response.matches(self.headers.get('If-None-Match')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', response.content_type)
+        self.send_header('Content-Length', str(len(response.gzipped if gzipped else response.body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if response.gzipped is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(response.gzipped if gzipped else response.body)
+    
+    def _stream_events(self, display_id=None):
+        """Stream state change events as Server-Sent Events until the client disconnects
+
+        All subscribers share the displays' pollers, so extra clients add
+        no load on the TVs.
+        """
+        subscriber = EVENTS.subscribe()
+        # The stream has no length, so it ends with the connection
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
             
-            # Wait for response
-            import time
-            time.sleep(0.5)
-            response = sock.recv(1024)
-            sock.close()
+            # Start with the known state so clients don't wait for a change
+            for tv in self.fleet:
+                if display_id is not None and tv.display_id != display_id:
+                    continue
+                for key in ('power', 'brightness'):
+                    value, _ = tv.cache.get(key)
+                    if value is not None:
+                        self._write_event('state', {'display': tv.display_id, 'key': key, 'value': value})
             
-            if response:
-                logger.info(f"Brightness response: {response.hex()}")
-                
-                # Parse the response - brightness values are in ASCII hex format
-                # Response: 01303041443132023030303031303030303036343030343603060d
-                # Decoded: \x0100AD12\x020000100000640046\x03\x06\r
-                # Format: SOH-0-0-A-D-1-2-STX-0-0-0-0-1-0-0-0-0-0-6-4-0-0-4-6-ETX-BCC-CR
+            while True:
                 try:
-                    response_str = response.decode('ascii')
-                    
-                    # Find the message part between STX and ETX
-                    stx_pos = response_str.find('\x02')
-                    etx_pos = response_str.find('\x03')
-                    
-                    if stx_pos != -1 and etx_pos != -1:
-                        message = response_str[stx_pos+1:etx_pos]
-                        logger.info(f"Message part: {repr(message)}")
-                        
-                        # Message format: result-page-opcode-type-maxvalue-currentvalue
-                        # Skip first 8 chars (result-page-opcode-type), then extract values
-                        if len(message) >= 16:
-                            max_brightness_hex = message[8:12]    # positions 8-11: max value
-                            current_brightness_hex = message[12:16]  # positions 12-15: current value
-                            
-                            max_brightness = int(max_brightness_hex, 16)
-                            current_brightness = int(current_brightness_hex, 16)
-                            
-                            logger.info(f"Brightness: {current_brightness}/{max_brightness}")
-                            return {
-                                'current': current_brightness,
-                                'max': max_brightness
-                            }
-                    
-                    logger.warning("Could not find STX/ETX in response")
-                    return {'current': 0, 'max': 100}
-                    
-                except (ValueError, IndexError) as e:
-                    logger.warning(f"Failed to parse brightness response: {e}")
-                    return {'current': 0, 'max': 100}
-            else:
-                logger.warning("No response to brightness query")
-                return {'current': 0, 'max': 100}
-                
-        except Exception as e:
-            logger.warning(f"Failed to query TV brightness: {e}")
-            return {'current': 0, 'max': 100}
-
-    def set_tv_brightness(self, percentage):
-        """Set TV brightness (0-100%) with retry logic"""
-        max_retries = 3
-        retry_delay = 2
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Setting TV brightness attempt {attempt + 1}/{max_retries}")
-                
-                # Get current max brightness to calculate the actual value
-                brightness_info = self.get_tv_brightness()
-                max_brightness = brightness_info['max']
-                
-                # Small delay after query to avoid overwhelming the TV
-                import time
-                time.sleep(0.5)
-                
-                # Calculate actual brightness value (use percentage directly as NEC expects 0-100)
-                brightness_value = int(percentage)
-                
-                # Exact brightness set command from NEC docs
-                # Header: SOH-'0'-'A'-'0'-'E'-'0'-'A' (Monitor ID A, Set parameter, Length 0A)
-                # Message: STX-'0'-'0'-'1'-'0'-VALUE-ETX (Op page 0, Op code 10h, 4-digit value)
-                cmd = bytearray([
-                    0x01,        # SOH
-                    0x30,        # '0' - Reserved
-                    0x41,        # 'A' - Monitor ID (TV ID 1)
-                    0x30,        # '0' - Message sender (controller)
-                    0x45,        # 'E' - Set parameter command
-                    0x30, 0x41,  # '0A' - Message length (10 bytes)
-                    0x02,        # STX - Start of message
-                    0x30, 0x30,  # '00' - Operation code page
-                    0x31, 0x30,  # '10' - Operation code (brightness = 10h)
-                ])
-                
-                # Add brightness value as 4 ASCII characters representing hex value
-                # Example: 50% = 50 decimal = 0032 hex = ASCII '0','0','3','2'
-                brightness_hex = f"{brightness_value:04X}"
-                cmd.extend([ord(c) for c in brightness_hex])
-                cmd.append(0x03)  # ETX
-                
-                # Calculate BCC
-                bcc = 0
-                for byte in cmd[1:]:
-                    bcc ^= byte
-                cmd.append(bcc)
-                cmd.append(0x0D)
-                
-                logger.info(f"Setting TV brightness to {percentage}% (value {brightness_value}): {cmd.hex()}")
-                
-                # Wait a bit between connection attempts to avoid overwhelming the TV
-                if attempt > 0:
-                    import time
-                    logger.info(f"Waiting {retry_delay} seconds before retry...")
-                    time.sleep(retry_delay)
-                
-                # Create socket connection with shorter timeout
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(3)  # Shorter timeout for quicker retry
-                
-                # Connect to TV
-                sock.connect((TV_IP, TV_PORT))
-                logger.info("Connected successfully for brightness set")
-                
-                # Send command
-                bytes_sent = sock.send(cmd)
-                logger.info(f"Sent {bytes_sent} bytes")
-                
-                # Wait for response
-                import time
-                time.sleep(1)
-                try:
-                    response = sock.recv(1024)
-                    if response:
-                        logger.info(f"Brightness set response: {response.hex()}")
-                    else:
-                        logger.warning("No response to brightness set command")
-                except socket.timeout:
-                    logger.info("No response to brightness set (timeout - may be normal)")
-                
-                sock.close()
-                logger.info(f"Successfully set brightness to {percentage}%")
-                return True
-                
-            except ConnectionRefusedError as e:
-                logger.warning(f"Connection refused on attempt {attempt + 1}: {e}")
-                if attempt < max_retries - 1:
-                    logger.info("Will retry after delay...")
+                    event = subscriber.get(timeout=EVENT_KEEPALIVE)
+                except queue.Empty:
+                    self.wfile.write(b': keepalive\n\n')
+                    self.wfile.flush()
                     continue
-                else:
-                    logger.error("All connection attempts failed")
-                    return False
-            except Exception as e:
-                logger.error(f"Failed to set TV brightness on attempt {attempt + 1}: {e}")
-                if attempt < max_retries - 1:
-                    continue
-                else:
-                    return False
-        
-        return False
+                if display_id is None or event['display'] == display_id:
+                    self._write_event('change', event)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("%s - event stream closed", self.address_string())
+        finally:
+            EVENTS.unsubscribe(subscriber)
+    
+    def _write_event(self, name, data):
+        self.wfile.write(f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode())
+        self.wfile.flush()
+    
+    def _resolve_display(self, path):
+        """Map a request path to (NECTV, route)
 
-    def send_tv_command(self, action):
-        """Send command to NEC TV"""
-        try:
-            command = COMMANDS[f'power_{action}']
-            logger.info(f"Sending {action} command: {command.hex()}")
-            
-            # Create socket connection
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)  # Shorter timeout to match bash script behavior
-            
-            # Connect to TV
-            logger.info(f"Connecting to TV at {TV_IP}:{TV_PORT}")
-            sock.connect((TV_IP, TV_PORT))
-            logger.info("Connected successfully")
-            
-            # Send command
-            bytes_sent = sock.send(command)
-            logger.info(f"Sent {bytes_sent} bytes")
-            
-            # Wait for response like the bash script does
-            import time
-            time.sleep(1)
-            try:
-                response = sock.recv(1024)
-                if response:
-                    logger.info(f"TV responded: {response.hex()}")
-                else:
-                    logger.warning("No response from TV")
-            except socket.timeout:
-                logger.info("No response from TV (timeout - this may be normal)")
-            except Exception as resp_e:
-                logger.warning(f"Error reading response: {resp_e}")
-            
-            # Close connection
-            sock.close()
-            logger.info("Connection closed")
-            
-            logger.info(f"Successfully sent {action} command to TV at {TV_IP}:{TV_PORT}")
+        /displays/<id>/power addresses a display of the fleet; the legacy
+        top-level routes address the default (first) display. Both are
+        None for an unknown display id.
+        """
+        if path.startswith('/displays/'):
+            display_id, _, rest = path[len('/displays/'):].partition('/')
+            tv = self.fleet.get(display_id)
+            return tv, ('/' + rest if tv is not None else None)
+        return self.fleet.default, path
+    
+    def _group_displays(self, data):
+        """Return the displays a group request targets, or None after a 400"""
+        ids = data.get('displays')
+        if ids is None:
+            return list(self.fleet)
+        if not isinstance(ids, list):
+            self._send_json(400, {'error': 'displays must be a list of display ids'})
+            return None
+        unknown = [display_id for display_id in ids if self.fleet.get(display_id) is None]
+        if unknown:
+            self._send_json(400, {'error': f'Unknown displays: {unknown}'})
+            return None
+        return [self.fleet.get(display_id) for display_id in ids]
+    
+    @staticmethod
+    def _batch_operation(op):
+        """Turn one /batch operation object into a callable taking a NECTV
+
+        Supported operations:
+          {"op": "power", "action": "on"}
+          {"op": "get", "parameter": "power"}
+          {"op": "get", "parameter": "contrast"}  (or "page"/"code" numbers)
+          {"op": "set", "parameter": "brightness", "value": 50}
+        """
+        kind = op['op']
+        if kind == 'power':
+            action = op['action']
+            if action not in ('on', 'off'):
+                raise ValueError(f'invalid power action {action!r}')
+            return lambda tv: tv.power_result(action)
+        if kind == 'get' and op.get('parameter') == 'power':
+            return lambda tv: NECTVHandler._power_state_result(tv.read('power', fresh=True)[0])
+        if kind not in ('get', 'set'):
+            raise ValueError(f'unknown op {kind!r}')
+        if 'parameter' in op:
+            name = op['parameter']
+            if name not in PARAMETERS:
+                raise ValueError(f'unknown parameter {name!r}')
+            page, code = PARAMETERS[name]
+        else:
+            page, code = int(op['page']), int(op['code'])
+            # Raises ValueError outside 0-255, before anything is queued
+            name = nec_protocol.opcode(page, code)
+        if kind == 'get':
+            return lambda tv: dict(tv.parameter_result(page, code), parameter=name)
+        value = op['value']
+        if not isinstance(value, (int, float)) or not 0 <= value <= 0xFFFF:
+            raise ValueError(f'invalid value {value!r}')
+        return lambda tv: dict(tv.parameter_result(page, code, value), parameter=name)
+    
+    @staticmethod
+    def _power_state_result(state):
+        return {'success': state != UNAVAILABLE, 'parameter': 'power', 'state': state}
+    
+    @staticmethod
+    def _valid_brightness(brightness):
+        return brightness is not None and isinstance(brightness, (int, float)) and 0 <= brightness <= 100
+    
+    @staticmethod
+    def _queued_result(command, tv):
+        """Wait for a queued command and add the queue statistics to its result"""
+        command.done.wait()
+        return dict(command.result, collapsed=command.collapsed, queue=tv.queue.stats())
+    
+    def _respond_async(self):
+        """Whether the client asked not to wait: ?async=1, ?wait=0 or Prefer: respond-async"""
+        if self._flag('async', False) or not self._flag('wait', True):
             return True
-            
-        except Exception as e:
-            logger.error(f"Failed to send {action} command to TV: {e}")
-            import traceback
-            logger.error(f"Full traceback: {traceback.format_exc()}")
-            return False
+        return 'respond-async' in self.headers.get('Prefer', '').lower()
+    
+    def _send_queued(self, command, tv):
+        if not self._respond_async():
+            self._send_json(200, self._queued_result(command, tv))
+            return
+        job_id = JOBS.add(tv, command)
+        self._send_json(202, {
+            'success': True,
+            'queued': True,
+            'job': job_id,
+            'message': f'{command.key} command queued',
+            'queue': tv.queue.stats()
+        }, {'Location': f'/jobs/{job_id}'})
+    
+    def _read_json(self):
+        """Parse the JSON request body, or send a 400 and return None"""
+        try:
+            content_length = int(self.headers['Content-Length'])
+            if content_length < 0:
+                raise ValueError(content_length)
+        except (TypeError, ValueError):
+            # Without a usable length the body can't be skipped either
+            self.close_connection = True
+            self._send_json(400, {'error': 'Content-Length header required'})
+            return None
+        post_data = self.rfile.read(content_length)
+        try:
+            data = json.loads(post_data.decode('utf-8'))
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': 'Invalid JSON'})
+            return None
+        if not isinstance(data, dict):
+            self._send_json(400, {'error': 'Invalid JSON'})
+            return None
+        return data
+    
+    def _send_json(self, status, body, headers=None):
+        self._send_body(status, 'application/json', json.dumps(body).encode(), headers)
+    
+    def _send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
     
     def log_message(self, format, *args):
-        """Override to use our logger"""
-        logger.info(f"{self.address_string()} - {format % args}")
+        """Override to use our logger; access logs only show at debug level"""
+        logger.debug("%s - " + format, self.address_string(), *args)
 
 def main():
     """Main service function"""
     logger.info("Starting NEC TV Control Service")
-    logger.info(f"TV IP: {TV_IP}")
-    logger.info(f"TV Port: {TV_PORT}")
     
-    # Start HTTP server
+    if DISPLAYS:
+        displays = [
+            NECTV(str(d['id']), d['ip'], int(d.get('port') or 7142), int(d.get('monitor_id') or 1))
+            for d in DISPLAYS
+        ]
+    else:
+        displays = [NECTV('tv', TV_IP, TV_PORT)]
+    for display in displays:
+        logger.info(f"Display {display.display_id}: {display.host}:{display.port}")
+    
+    NECTVHandler.fleet = DisplayFleet(displays)
+    snapshot = SnapshotStore(SNAPSHOT_PATH, SNAPSHOT_INTERVAL) if SNAPSHOT_PATH else None
+    if snapshot is not None:
+        NECTVHandler.fleet.restore(snapshot)
+        snapshot.start(NECTVHandler.fleet.snapshot_state)
+    NECTVHandler.static = render_static_responses(NECTVHandler.fleet)
+    NECTVHandler.fleet.start()
+    
+    if MQTT_HOST:
+        logger.info(f"MQTT broker: {MQTT_HOST}:{MQTT_PORT}")
+        MQTTBridge(NECTVHandler.fleet, MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD).start()
+    
+    # Start HTTP server - each request gets its own thread so a slow TV
+    # query doesn't block /health or other routes. TV I/O is still
+    # serialized per display by TVConnection.
     server_address = ('', 8124)
-    httpd = HTTPServer(server_address, NECTVHandler)
+    httpd = ThreadingHTTPServer(server_address, NECTVHandler)
     
     logger.info("Server started on port 8124")
     logger.info("Visit http://localhost:8124/homeassistant for setup instructions")
     
+    # The add-on is stopped with SIGTERM; shut down the same way as on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info("Shutting down server")
         httpd.shutdown()
+        if snapshot is not None:
+            snapshot.flush()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -45,13 +45,14 @@ def test_service_functions(service_module, ip, port):
         return False
     
     try:
-        # Test the commands directly using the service's COMMANDS dict
+        # Test the commands directly using the service's protocol codec
+        import nec_protocol
         print("Testing service functions:")
         
         for action in ['on', 'off']:
             try:
                 import socket
-                command = service_module.COMMANDS[f'power_{action}']
+                command = nec_protocol.power_control(action)
                 
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.settimeout(5)
@@ -63,7 +64,11 @@ def test_service_functions(service_module, ip, port):
                     response = sock.recv(1024)
                     sock.close()
                     if response:
-                        print(f"✓ Service command: power {action.upper()} successful (got response)")
+                        replies = nec_protocol.FrameDecoder().feed(response)
+                        if replies and replies[0].ok:
+                            print(f"✓ Service command: power {action.upper()} successful (got response)")
+                        else:
+                            print(f"✗ Service command: power {action.upper()} got unexpected response {response.hex()}")
                     else:
                         print(f"✓ Service command: power {action.upper()} sent (no response)")
                 except:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service modules live where the add-on image installs them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rootfs', 'usr', 'bin'))
@@ -0,0 +1,73 @@
+import math
+
+import pytest
+
+from nec_history import HistoryRing, downsample
+
+
+def test_sample_spanning_a_bucket_boundary():
+    first, second = downsample([0.0, 150.0], [1.0, 0.0], since=0.0, until=200.0, step=100.0, max_gap=1000.0)
+    assert (first['samples'], first['known_seconds'], first['avg'], first['last']) == (1, 100.0, 1.0, 1.0)
+    # The first value holds into the second bucket until the next sample
+    assert (second['samples'], second['known_seconds'], second['avg']) == (1, 100.0, 0.5)
+    assert (second['min'], second['max'], second['last']) == (0.0, 1.0, 0.0)
+
+
+def test_value_held_for_max_gap_at_most():
+    first, second = downsample([0.0], [1.0], since=0.0, until=200.0, step=100.0, max_gap=30.0)
+    assert (first['known_seconds'], first['avg']) == (30.0, 1.0)
+    assert (second['known_seconds'], second['avg'], second['last'], second['min']) == (0.0, None, None, None)
+
+
+def test_nan_sample_is_unknown():
+    bucket, = downsample([0.0, 50.0, 100.0], [1.0, math.nan, 0.0], since=0.0, until=200.0, step=200.0, max_gap=1000.0)
+    assert bucket['samples'] == 3
+    assert bucket['known_seconds'] == 150.0
+    assert bucket['avg'] == pytest.approx(50.0 / 150.0)
+    assert (bucket['min'], bucket['max'], bucket['last']) == (0.0, 1.0, 0.0)
+
+
+def test_sample_before_since_carries_into_the_range():
+    bucket, = downsample([0.0, 150.0], [80.0, 40.0], since=100.0, until=200.0, step=100.0, max_gap=1000.0)
+    assert bucket['samples'] == 1
+    assert bucket['avg'] == 60.0
+
+
+def test_bucket_count_rounds_up():
+    buckets = downsample([], [], since=0.0, until=250.0, step=100.0, max_gap=10.0)
+    assert [bucket['start'] for bucket in buckets] == [0.0, 100.0, 200.0]
+    assert all(bucket['avg'] is None and bucket['samples'] == 0 for bucket in buckets)
+
+
+def test_ring_keeps_latest_samples_in_order():
+    ring = HistoryRing(3)
+    for timestamp in range(1, 6):
+        ring.append(timestamp * 10, timestamp=float(timestamp))
+    assert len(ring) == 3
+    times, values = ring.samples()
+    assert (list(times), list(values)) == ([3.0, 4.0, 5.0], [30.0, 40.0, 50.0])
+
+
+def test_wrapped_ring_with_since_before_oldest_sample():
+    ring = HistoryRing(4)
+    for timestamp in range(1, 8):
+        ring.append(timestamp, timestamp=float(timestamp))
+    times, values = ring.samples(since=0.0)
+    assert (list(times), list(values)) == ([4.0, 5.0, 6.0, 7.0], [4.0, 5.0, 6.0, 7.0])
+
+
+def test_samples_since_start_with_the_last_sample_before():
+    ring = HistoryRing(4)
+    for timestamp in range(1, 7):
+        ring.append(timestamp, timestamp=float(timestamp))
+    times, _ = ring.samples(since=4.5)
+    assert list(times) == [4.0, 5.0, 6.0]
+
+
+def test_partly_filled_ring():
+    ring = HistoryRing(8)
+    ring.append(1.0, timestamp=1.0)
+    ring.append(math.nan, timestamp=2.0)
+    times, values = ring.samples()
+    assert list(times) == [1.0, 2.0]
+    assert values[0] == 1.0 and math.isnan(values[1])
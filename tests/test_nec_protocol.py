@@ -0,0 +1,116 @@
+import pytest
+
+import nec_protocol
+from nec_protocol import CONTROLLER, CR, ETX, SOH, STX, FrameDecoder, FrameError
+
+
+def reply_frame(message, message_type=nec_protocol.TYPE_GET_PARAMETER_REPLY, monitor_id=1):
+    """Monitor-to-controller frame, as a display sends it"""
+    body = ('0' + CONTROLLER + nec_protocol.monitor_address(monitor_id) + message_type
+            + f'{len(message) + 2:02X}').encode('latin-1')
+    body += bytes([STX]) + message.encode('ascii') + bytes([ETX])
+    return bytes([SOH]) + body + bytes([nec_protocol.bcc(body), CR])
+
+
+BRIGHTNESS_REPLY = reply_frame('00001000006400' + '46')
+POWER_REPLY = reply_frame('0200D60000040001', nec_protocol.TYPE_COMMAND_REPLY)
+
+
+def test_feed_reply_split_one_byte_at_a_time():
+    decoder = FrameDecoder()
+    replies = []
+    for byte in BRIGHTNESS_REPLY:
+        replies += decoder.feed(bytes([byte]))
+    assert len(replies) == 1
+    assert (replies[0].opcode, replies[0].max, replies[0].current) == ((0x00, 0x10), 100, 70)
+    assert len(decoder) == 0
+    assert decoder.errors == 0
+
+
+def test_feed_two_replies_in_one_chunk():
+    replies = FrameDecoder().feed(BRIGHTNESS_REPLY + POWER_REPLY)
+    assert [reply.opcode for reply in replies] == [(0x00, 0x10), (0x01, 0xD6)]
+    assert nec_protocol.power_state(replies[1]) == 'on'
+
+
+def test_feed_keeps_trailing_partial_frame():
+    decoder = FrameDecoder()
+    assert len(decoder.feed(BRIGHTNESS_REPLY + POWER_REPLY[:5])) == 1
+    assert len(decoder) == 5
+    assert [reply.opcode for reply in decoder.feed(POWER_REPLY[5:])] == [(0x01, 0xD6)]
+
+
+def test_feed_skips_garbage_before_soh():
+    decoder = FrameDecoder()
+    replies = decoder.feed(b'\x00\xffnoise\r' + BRIGHTNESS_REPLY)
+    assert len(replies) == 1
+    assert decoder.errors == 0
+
+
+def test_feed_drops_oversize_run_without_etx():
+    decoder = FrameDecoder(max_frame_size=64)
+    assert decoder.feed(bytes([SOH]) + b'x' * 100) == []
+    assert decoder.errors == 1
+    assert len(decoder) <= 64
+    # The decoder resyncs on the next frame
+    assert len(decoder.feed(BRIGHTNESS_REPLY)) == 1
+
+
+def test_feed_rejects_bad_bcc():
+    corrupt = bytearray(BRIGHTNESS_REPLY)
+    corrupt[-2] ^= 0xFF
+    decoder = FrameDecoder()
+    assert decoder.feed(bytes(corrupt) + POWER_REPLY)[0].opcode == (0x01, 0xD6)
+    assert decoder.errors == 1
+    assert 'BCC mismatch' in str(decoder.last_error)
+
+
+def test_feed_rejects_missing_cr():
+    decoder = FrameDecoder()
+    assert decoder.feed(BRIGHTNESS_REPLY[:-1] + b'\x00') == []
+    assert decoder.errors == 1
+
+
+@pytest.mark.parametrize('monitor_id', [1, 64, 100])
+def test_command_frame_round_trip(monitor_id):
+    frame = nec_protocol.set_parameter(0x00, 0x10, 55, monitor_id)
+    assert nec_protocol.bcc(frame[1:-2]) == frame[-2]
+    fields = nec_protocol.parse_command(frame)
+    assert fields['monitor'] == nec_protocol.monitor_address(monitor_id)
+    assert (fields['type'], fields['page'], fields['code'], fields['value']) == (
+        nec_protocol.TYPE_SET_PARAMETER, 0x00, 0x10, 55)
+
+
+@pytest.mark.parametrize('monitor_id', [1, 64, 100])
+def test_reply_frame_round_trip(monitor_id):
+    frame = reply_frame('00001000006400' + '46', monitor_id=monitor_id)
+    reply, = FrameDecoder().feed(frame)
+    assert reply.monitor == nec_protocol.monitor_address(monitor_id)
+    assert ord(reply.monitor) == 0x40 + monitor_id
+    assert reply.raw == frame
+
+
+@pytest.mark.parametrize('monitor_id', [0, 101])
+def test_monitor_id_out_of_range(monitor_id):
+    with pytest.raises(ValueError):
+        nec_protocol.monitor_address(monitor_id)
+
+
+def test_opcode_out_of_range():
+    with pytest.raises(ValueError):
+        nec_protocol.get_parameter(0x100, 0x10)
+
+
+def test_parse_reply_rejects_malformed_message():
+    with pytest.raises(FrameError):
+        nec_protocol.parse_reply(reply_frame('zz'))
+
+
+def test_expect_parameter_checks_opcode_and_result():
+    reply, = FrameDecoder().feed(BRIGHTNESS_REPLY)
+    assert nec_protocol.expect_parameter(reply, 0x00, 0x10) is reply
+    with pytest.raises(nec_protocol.ProtocolError):
+        nec_protocol.expect_parameter(reply, 0x00, 0x12)
+    unsupported, = FrameDecoder().feed(reply_frame('01001200000000' + '00'))
+    with pytest.raises(nec_protocol.ProtocolError):
+        nec_protocol.expect_parameter(unsupported, 0x00, 0x12)
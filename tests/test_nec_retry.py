@@ -0,0 +1,216 @@
+import json
+import socket
+
+import pytest
+
+import nec_retry
+from nec_protocol import FrameError, ProtocolError
+from nec_retry import (CLOSED, CONNECTION, CORRUPT, DEADLINE, ERROR, HALF_OPEN, OPEN, REFUSED, REJECTED, TIMEOUT,
+                       UNAVAILABLE, CircuitBreaker, CircuitOpenError, RetryError, RetryPolicy, classify)
+
+
+class FakeClock:
+    """Stands in for the time and random modules nec_retry uses"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    @staticmethod
+    def uniform(low, high):
+        # Always the longest backoff, so the schedule is predictable
+        return high
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(nec_retry, 'time', fake)
+    monkeypatch.setattr(nec_retry, 'random', fake)
+    return fake
+
+
+def failing(clock, *errors, result='ok', duration=0.0):
+    """Operation raising errors in turn, then returning result; records the timeouts it got"""
+    errors = list(errors)
+    timeouts = []
+
+    def operation(timeout):
+        timeouts.append(timeout)
+        clock.now += duration
+        if errors:
+            raise errors.pop(0)
+        return result
+    operation.timeouts = timeouts
+    return operation
+
+
+@pytest.mark.parametrize('error, error_class', [
+    (CircuitOpenError('open'), UNAVAILABLE),
+    (ConnectionRefusedError(), REFUSED),
+    (socket.timeout(), TIMEOUT),
+    (TimeoutError(), TIMEOUT),
+    (FrameError('bcc'), CORRUPT),
+    (ProtocolError('rejected'), REJECTED),
+    (ConnectionResetError(), CONNECTION),
+    (KeyError('bug'), ERROR),
+])
+def test_classify(error, error_class):
+    assert classify(error) == error_class
+
+
+def test_retries_transient_failures_with_backoff(clock):
+    policy = RetryPolicy(attempts=4, base_delay=0.25, max_delay=0.4, deadline=10.0)
+    operation = failing(clock, ConnectionRefusedError(), socket.timeout(), FrameError('bcc'))
+    assert policy.run(operation) == ('ok', 4)
+    # Exponential, capped at max_delay
+    assert clock.sleeps == [0.25, 0.4, 0.4]
+
+
+def test_rejected_is_not_retried(clock):
+    operation = failing(clock, ProtocolError('not supported'))
+    with pytest.raises(RetryError) as raised:
+        RetryPolicy(attempts=5).run(operation)
+    assert (raised.value.attempts, raised.value.error_class) == (1, REJECTED)
+    assert isinstance(raised.value.last_error, ProtocolError)
+    assert clock.sleeps == []
+
+
+def test_gives_up_after_attempts(clock):
+    operation = failing(clock, *[socket.timeout()] * 5)
+    with pytest.raises(RetryError) as raised:
+        RetryPolicy(attempts=3, base_delay=0.1, deadline=60.0).run(operation)
+    assert (raised.value.attempts, raised.value.error_class) == (3, TIMEOUT)
+    assert len(operation.timeouts) == 3
+
+
+def test_stops_at_deadline(clock):
+    policy = RetryPolicy(attempts=10, base_delay=0.5, max_delay=0.5, deadline=2.0, attempt_timeout=1.0)
+    operation = failing(clock, *[socket.timeout()] * 10, duration=0.5)
+    started = clock.now
+    with pytest.raises(RetryError) as raised:
+        policy.run(operation)
+    # Attempts at 0 and 1.0; a third would start at 2.0, the deadline
+    assert raised.value.attempts == 2
+    assert 'deadline' in str(raised.value)
+    assert clock.now - started <= 2.0
+
+
+def test_attempt_timeout_is_cut_to_the_deadline(clock):
+    policy = RetryPolicy(attempts=3, base_delay=0.2, max_delay=0.2, deadline=1.0, attempt_timeout=3.0)
+    operation = failing(clock, socket.timeout(), duration=0.5)
+    assert policy.run(operation) == ('ok', 2)
+    assert operation.timeouts == [1.0, pytest.approx(0.3)]
+
+
+def test_caller_deadline_wins(clock):
+    operation = failing(clock)
+    with pytest.raises(RetryError) as raised:
+        RetryPolicy(deadline=10.0).run(operation, deadline=clock.now)
+    assert (raised.value.attempts, raised.value.error_class) == (0, DEADLINE)
+    assert operation.timeouts == []
+
+
+def test_on_retry_reports_each_retry(clock):
+    calls = []
+    operation = failing(clock, ConnectionResetError(), ConnectionResetError())
+    RetryPolicy(attempts=3, base_delay=0.1).run(operation, on_retry=lambda *args: calls.append(args[:2]))
+    assert calls == [(1, CONNECTION), (2, CONNECTION)]
+
+
+def test_replace_keeps_other_settings():
+    policy = RetryPolicy(attempts=4, base_delay=0.5, deadline=20.0).replace(attempts=6)
+    assert (policy.attempts, policy.base_delay, policy.deadline) == (6, 0.5, 20.0)
+
+
+def test_breaker_opens_after_threshold_unreachable_failures():
+    changes = []
+    breaker = CircuitBreaker(failure_threshold=2, on_change=lambda old, new: changes.append((old, new)))
+    breaker.record_failure(TIMEOUT)
+    breaker.record_failure(REJECTED)  # the display answered - not counted
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure(REFUSED, ConnectionRefusedError('refused'))
+    assert breaker.state == OPEN and not breaker.allow()
+    assert changes == [(CLOSED, OPEN)]
+    assert breaker.last_error.startswith('refused')
+
+
+def test_breaker_half_open_probe_closes_or_reopens():
+    changes = []
+    breaker = CircuitBreaker(failure_threshold=1, on_change=lambda old, new: changes.append((old, new)))
+    breaker.record_failure(CONNECTION)
+    breaker.half_open()
+    assert breaker.state == HALF_OPEN and not breaker.allow()
+    # A failed probe reopens at once, whatever the threshold
+    breaker.record_failure(TIMEOUT)
+    assert breaker.state == OPEN
+    breaker.half_open()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+    assert changes == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+
+def test_half_open_only_from_open():
+    breaker = CircuitBreaker()
+    breaker.half_open()
+    assert breaker.state == CLOSED
+
+
+class TestRetryPolicyOptions:
+    """load_retry_policies: the retry_policies option and RETRY_POLICIES variable"""
+
+    @pytest.fixture(autouse=True)
+    def service(self):
+        import nec_tv_service
+        self.service = nec_tv_service
+
+    def load(self, overrides):
+        return self.service.load_retry_policies(overrides if isinstance(overrides, str) else json.dumps(overrides))
+
+    def assert_defaults(self, policies):
+        for name, policy in self.service.DEFAULT_RETRY_POLICIES.items():
+            assert policies[name] is policy
+
+    def test_empty_keeps_defaults(self):
+        self.assert_defaults(self.service.load_retry_policies(None))
+        self.assert_defaults(self.load([]))
+
+    def test_option_list(self):
+        policies = self.load([{'operation': 'power_set', 'attempts': 6, 'deadline': 30}])
+        assert (policies['power_set'].attempts, policies['power_set'].deadline) == (6, 30)
+        assert policies['power_set'].max_delay == self.service.DEFAULT_RETRY_POLICIES['power_set'].max_delay
+        assert policies['power_query'] is self.service.DEFAULT_RETRY_POLICIES['power_query']
+
+    def test_object_form(self):
+        assert self.load({'brightness_set': {'base_delay': 0}})['brightness_set'].base_delay == 0
+
+    @pytest.mark.parametrize('overrides', [
+        {'power_set': {'retries': 5}},
+        {'power_sett': {'attempts': 5}},
+        {'power_set': 5},
+        {'power_set': {'attempts': 0}},
+        {'power_set': {'attempts': 2.5}},
+        {'power_set': {'attempts': True}},
+        {'power_set': {'deadline': 0}},
+        {'power_set': {'base_delay': -1}},
+        {'power_set': {'max_delay': '2'}},
+        [{'attempts': 5}],
+        [{'operation': ['power_set'], 'attempts': 5}],
+        [5],
+        5,
+        'not json',
+    ])
+    def test_bad_input_keeps_defaults(self, overrides, caplog):
+        self.assert_defaults(self.load(overrides))
+        assert any(record.levelname == 'WARNING' for record in caplog.records)
+
+    def test_bad_setting_keeps_good_ones(self):
+        policy = self.load({'power_set': {'attempts': 6, 'deadline': -1}})['power_set']
+        assert (policy.attempts, policy.deadline) == (6, self.service.DEFAULT_RETRY_POLICIES['power_set'].deadline)
@@ -0,0 +1,107 @@
+import threading
+import time
+
+from nec_scheduler import LANE_POLL, LANE_SET, LANE_USER, DisplayScheduler, background, lane_for
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def take_turn(scheduler, lane, served=None, name=None):
+    with scheduler.turn(lane):
+        if served is not None:
+            served.append(name)
+
+
+def test_lane_for_operations():
+    assert lane_for('power_set') == LANE_USER
+    assert lane_for('brightness_get') == LANE_USER
+    assert lane_for('brightness_set') == LANE_SET
+    assert lane_for('parameter_set') == LANE_SET
+    with background():
+        assert lane_for('power_set') == LANE_POLL
+        with background():
+            pass
+        # Leaving a nested block keeps the outer one in force
+        assert lane_for('brightness_set') == LANE_POLL
+    assert lane_for('power_query') == LANE_USER
+
+
+def test_waiting_callers_are_served_by_lane_then_arrival():
+    scheduler = DisplayScheduler(rate=1000, burst=100, min_gap=0)
+    served = []
+    waiting = lambda: sum(lane['waiting'] for lane in scheduler.stats()['lanes'].values())
+    threads = []
+    with scheduler.turn(LANE_USER):
+        # Arrive lowest lane first, so arrival order alone would be wrong
+        for name, lane in [('poll-1', LANE_POLL), ('set-1', LANE_SET), ('poll-2', LANE_POLL),
+                           ('user-1', LANE_USER), ('set-2', LANE_SET), ('user-2', LANE_USER)]:
+            thread = threading.Thread(target=take_turn, args=(scheduler, lane, served, name))
+            thread.start()
+            threads.append(thread)
+            expected = len(threads)
+            wait_until(lambda: waiting() == expected)
+    for thread in threads:
+        thread.join(2)
+    assert served == ['user-1', 'user-2', 'set-1', 'set-2', 'poll-1', 'poll-2']
+
+
+def test_turn_is_reentrant_for_its_owner():
+    scheduler = DisplayScheduler()
+    served = []
+    with scheduler.turn(LANE_USER):
+        other = threading.Thread(target=take_turn, args=(scheduler, LANE_USER, served, 'other'))
+        other.start()
+        wait_until(lambda: scheduler.stats()['lanes'][LANE_USER]['waiting'] == 1)
+        with scheduler.turn(LANE_POLL) as waited:
+            assert waited == 0.0
+        # Still held after the nested turn ends
+        time.sleep(0.05)
+        assert served == []
+    other.join(2)
+    assert served == ['other']
+
+
+def test_token_bucket_allows_burst_then_rate():
+    scheduler = DisplayScheduler(rate=20, burst=2, min_gap=0)
+    started = time.monotonic()
+    with scheduler.turn(LANE_USER):
+        waits = [scheduler.pace(LANE_USER) for _ in range(4)]
+    elapsed = time.monotonic() - started
+    # Two tokens are there at once, the next two come 50 ms apart
+    assert waits[0] < 0.02 and waits[1] < 0.02
+    assert elapsed >= 0.09
+    assert scheduler.stats()['lanes'][LANE_USER]['exchanges'] == 4
+
+
+def test_min_gap_after_an_exchange():
+    scheduler = DisplayScheduler(rate=1000, burst=10, min_gap=0.05)
+    with scheduler.turn(LANE_SET):
+        scheduler.pace(LANE_SET)
+        scheduler.finished()
+        assert scheduler.pace(LANE_SET) >= 0.045
+
+
+def test_only_foreground_lanes_reset_idle_time():
+    scheduler = DisplayScheduler(rate=1000, burst=10, min_gap=0)
+    with scheduler.turn(LANE_POLL):
+        scheduler.pace(LANE_POLL)
+    assert scheduler.foreground_idle() == float('inf')
+    with scheduler.turn(LANE_USER):
+        scheduler.pace(LANE_USER)
+    assert scheduler.foreground_idle() < 1.0
+
+
+def test_on_waiting_reports_queue_lengths():
+    counts = []
+    scheduler = DisplayScheduler(on_waiting=lambda lane, count: counts.append((lane, count)))
+    with scheduler.turn(LANE_USER):
+        thread = threading.Thread(target=take_turn, args=(scheduler, LANE_POLL))
+        thread.start()
+        wait_until(lambda: (LANE_POLL, 1) in counts)
+    thread.join(2)
+    assert counts == [(LANE_USER, 1), (LANE_USER, 0), (LANE_POLL, 1), (LANE_POLL, 0)]